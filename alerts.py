@@ -0,0 +1,184 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+import market_calendar as cal
+import metrics
+
+# ==========================================
+# 提醒规则引擎：每个 tick 只对数值变化的行做向量化阈值判断
+# ==========================================
+RULES_FILE = "alert_rules.json"
+LOG_FILE = "alerts.jsonl"
+COOLDOWN = 1800        # 同一规则同一基金两次提醒的最小间隔(秒)
+MAX_PER_MINUTE = 10    # 全局每分钟最多提醒条数，超出的只计数不提醒
+LOG_KEEP = 200         # 内存中保留的最近提醒条数
+
+KINDS = {
+    "move": "单日涨跌幅超过 (%)",
+    "day_loss": "组合今日亏损超过 (¥)",
+    "nav_published": "当日净值已公布",
+    "below_cost": "跌破持仓成本",
+}
+FUND_KINDS = ("move", "nav_published", "below_cost")
+WATCH_COLUMNS = ["est_rate", "最新净值", "持仓成本", "已更新"]  # 这些列都没变的行不参与判断
+PORTFOLIO = "组合"
+
+class AlertEngine:
+    """规则改动时编译成按代码 / 通配两张表；每个 tick 先与上一 tick 的值比较出变化行，
+    只把变化行与规则表连接后一次算出所有条件。条件由假变真才触发 (当日内去重)，再按冷却时间和全局速率限流。
+    触发的提醒追加到 LOG_FILE，并留在内存里供各会话按序号拉取弹出。"""
+
+    def __init__(self, rules_path=RULES_FILE, log_path=LOG_FILE):
+        self.rules_path, self.log_path = rules_path, log_path
+        self._lock = threading.Lock()
+        self._rules = []
+        if os.path.exists(rules_path):
+            try:
+                with open(rules_path, "r", encoding="utf-8") as f: self._rules = json.load(f)
+            except (OSError, ValueError) as e: print(f"Alert rules load error: {e}")
+        self._compile()
+        self._day, self._prev, self._prev_total = None, None, None
+        self._active = set()      # 条件当前为真的 (规则 id, 行键)
+        self._last_fired = {}     # (规则 id, 行键) -> 上次提醒时间
+        self._recent = deque()    # 最近一分钟的提醒时间 (全局限流)
+        self._log = deque(maxlen=LOG_KEEP)
+        self.seq = 0
+
+    # ---------- 规则 ----------
+    def _compile(self):
+        table = pd.DataFrame(self._rules, columns=["id", "kind", "code", "threshold"])
+        table['threshold'] = pd.to_numeric(table['threshold'], errors="coerce").fillna(0.0)
+        funds = table[table['kind'].isin(FUND_KINDS)]
+        self._by_code = funds[funds['code'] != "*"]
+        self._wildcard = funds[funds['code'] == "*"]
+        self._portfolio = table[table['kind'] == "day_loss"][['id', 'threshold']].to_numpy()
+
+    def _save_rules(self):
+        tmp = f"{self.rules_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f: json.dump(self._rules, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.rules_path)
+
+    def rules(self):
+        with self._lock: return [dict(r) for r in self._rules]
+
+    def add_rule(self, kind, code="*", threshold=0.0):
+        if kind not in KINDS: raise ValueError(f"未知规则类型: {kind}")
+        rule = {"id": uuid.uuid4().hex[:8], "kind": kind, "code": str(code) if code == "*" else str(code).zfill(6), "threshold": float(threshold)}
+        with self._lock:
+            self._rules.append(rule)
+            self._save_rules(); self._compile()
+            # 新规则对所有行生效：清掉上一 tick 的值，下一次全量判断一遍
+            self._prev, self._prev_total = None, None
+        return rule['id']
+
+    def remove_rule(self, rule_id):
+        with self._lock:
+            self._rules = [r for r in self._rules if r['id'] != rule_id]
+            self._active = {a for a in self._active if a[0] != rule_id}
+            self._save_rules(); self._compile()
+
+    # ---------- 判断 ----------
+    def _changed(self, rows):
+        """与上一 tick 比较，返回数值有变化 (或新出现) 的行"""
+        cur = rows.set_index(rows['基金代码'] + "|" + rows['渠道'])
+        prev = self._prev
+        # 本轮缺席的行 (如取数失败被排除) 保留上一次的基线
+        self._prev = cur[WATCH_COLUMNS] if prev is None else cur[WATCH_COLUMNS].combine_first(prev)
+        if prev is None: return cur
+        old = prev.reindex(cur.index)
+        diff = (cur[WATCH_COLUMNS].to_numpy() != old.to_numpy()).any(axis=1)
+        return cur[diff]
+
+    def _fund_hits(self, changed):
+        """变化行 × 规则 -> 每个 (规则, 行) 的条件真假与提醒文本所需字段"""
+        if changed.empty or (self._by_code.empty and self._wildcard.empty): return None
+        rows = changed.rename_axis("key").reset_index()
+        pairs = pd.concat([rows.merge(self._by_code, left_on="基金代码", right_on="code"),
+                           rows.merge(self._wildcard, how="cross")], ignore_index=True)
+        if pairs.empty: return None
+        kind, rate, nav, cost = pairs['kind'].to_numpy(), pairs['est_rate'].to_numpy(float), pairs['最新净值'].to_numpy(float), pairs['持仓成本'].to_numpy(float)
+        pairs['hit'] = np.select(
+            [kind == "move", kind == "nav_published", kind == "below_cost"],
+            [np.abs(rate) * 100 >= pairs['threshold'].to_numpy(float), pairs['已更新'].to_numpy(bool), (cost > 0) & (nav < cost)],
+            default=False)
+        return pairs
+
+    def _message(self, kind, row, threshold):
+        name, rate = row.get('基金名称', ""), row.get('est_rate', 0.0) * 100
+        if kind == "move": return f"{name} 今日{'上涨' if rate > 0 else '下跌'} {rate:+.2f}%，超过 {threshold:g}%"
+        if kind == "nav_published": return f"{name} 今日净值已公布：{row['最新净值']:.4f} ({rate:+.2f}%)"
+        if kind == "below_cost": return f"{name} 跌破成本：{row['最新净值']:.4f} < {row['持仓成本']:.4f}"
+        return f"组合今日亏损 {-row['今日盈亏']:,.2f}，超过 ¥{threshold:,.0f}"
+
+    def evaluate(self, rows, day_gain, now=None):
+        """行情中心每个 tick 调用：rows 为 calculate_dashboard_data 的结果；返回本次新提醒列表"""
+        now = time.time() if now is None else now
+        day = str(cal.now_in("CN", now).date())
+        with self._lock, metrics.timer("alerts_seconds"):
+            if day != self._day:  # 跨日后“已触发”状态清零，如净值公布每天提醒一次
+                self._day, self._prev, self._prev_total, self._active = day, None, None, set()
+            candidates = []  # (规则 id, 行键, 种类, 代码, 文本)
+            # 数据源为 "-" 的是取数失败的占位行 (净值按 1.0)，不参与判断，也不进入基线；有占位行时组合盈亏不可信
+            valid = (rows['数据源'] != "-").to_numpy(bool)
+            pairs = self._fund_hits(self._changed(rows[valid]))
+            if pairs is not None:
+                keys = list(zip(pairs['id'], pairs['key']))
+                hit = pairs['hit'].to_numpy(bool)
+                for i in np.flatnonzero(hit):
+                    if keys[i] not in self._active:
+                        r = pairs.iloc[i]
+                        candidates.append((keys[i], r['kind'], r['基金代码'], self._message(r['kind'], r, r['threshold'])))
+                self._active.difference_update(k for k, h in zip(keys, hit) if not h)
+                self._active.update(k for k, h in zip(keys, hit) if h)
+            if len(self._portfolio) and valid.all() and day_gain != self._prev_total:
+                self._prev_total = day_gain
+                for rid, th in self._portfolio:
+                    key = (rid, PORTFOLIO)
+                    if -day_gain >= th:
+                        if key not in self._active: candidates.append((key, "day_loss", PORTFOLIO, self._message("day_loss", {"今日盈亏": day_gain}, th)))
+                        self._active.add(key)
+                    else: self._active.discard(key)
+            return self._fire(candidates, now)
+
+    def _fire(self, candidates, now):
+        while self._recent and now - self._recent[0] > 60: self._recent.popleft()
+        fired = []
+        for key, kind, code, text in candidates:
+            if now - self._last_fired.get(key, 0) < COOLDOWN or len(self._recent) >= MAX_PER_MINUTE:
+                metrics.inc("alerts_total", kind=kind, result="suppressed"); continue
+            self._last_fired[key] = now
+            self._recent.append(now)
+            self.seq += 1
+            fired.append({"seq": self.seq, "ts": now, "rule": key[0], "kind": kind, "code": code, "message": text})
+            metrics.inc("alerts_total", kind=kind, result="fired")
+        if fired:
+            self._log.extend(fired)
+            try:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(a, ensure_ascii=False) + "\n" for a in fired))
+            except OSError as e: print(f"Alert log write error: {e}")
+        return fired
+
+    # ---------- 读取 ----------
+    def since(self, seq):
+        """序号大于 seq 的提醒 (各会话据此弹出未看过的)"""
+        with self._lock: return [a for a in self._log if a['seq'] > seq]
+
+    def recent(self, limit=20):
+        with self._lock: return list(self._log)[::-1][:limit]
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None: _engine = AlertEngine()
+        return _engine
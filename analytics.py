@@ -0,0 +1,282 @@
+import bisect
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+# ==========================================
+# 历史业绩分析：交易记录 × 历史净值 回放
+# ==========================================
+# 状态都是 日期 × 基金 的稠密矩阵 (行=净值日，列=基金)，容量按倍数增长；
+# 新增一天只计算新的一行，补录过去的交易或迟到的净值只重算该日期之后的后缀。
+DEFAULT_LOOKBACK_DAYS = 365
+XIRR_MAX_ITER = 200
+LATE_NAV_ROWS = 5   # 增量同步时回看的净值日数 (QDII 等净值晚一天公布)
+
+def tx_effect(tx):
+    """一笔已结算交易 -> (份额变化, 外部资金流入)，买入为正、卖出为负；缺成交净值的返回 (0, 0)"""
+    nav, value = float(tx.get('settle_nav') or 0), float(tx.get('value') or 0)
+    if nav <= 0: return 0.0, 0.0
+    shares = value / nav if tx.get('mode') == "amount" else value
+    return (shares, shares * nav) if tx.get('type') == "buy" else (-shares, -shares * nav)
+
+def xirr(days, cashflows):
+    """不规则现金流的年化内部收益率 (days 为距首笔的天数)；无解时返回 nan"""
+    cf = np.asarray(cashflows, dtype=float)
+    t = np.asarray(days, dtype=float) / 365.0
+    if not ((cf > 0).any() and (cf < 0).any()): return float("nan")
+    npv = lambda r: float(np.sum(cf * np.power(1.0 + r, -t)))
+    lo, hi = -0.9999, 1.0
+    f_lo = npv(lo)
+    while np.sign(npv(hi)) == np.sign(f_lo) and hi < 1e6: hi *= 4
+    if np.sign(npv(hi)) == np.sign(f_lo): return float("nan")
+    for _ in range(XIRR_MAX_ITER):
+        mid = (lo + hi) / 2
+        f_mid = npv(mid)
+        if abs(f_mid) < 1e-9 or hi - lo < 1e-12: break
+        if np.sign(f_mid) == np.sign(f_lo): lo, f_lo = mid, f_mid
+        else: hi = mid
+    return (lo + hi) / 2
+
+class PerformanceEngine:
+    """逐行维护：净值(前值填充)、是否为真实净值、收盘后持有份额、当日按基金的外部资金流入、组合市值、时间加权累计净值。
+    期初持仓 (起点前已持有或手工录入、没有对应交易记录的份额) 视作起点当天的一笔投入。"""
+
+    def __init__(self):
+        self.dates = []                     # 已排序的净值日 'YYYY-MM-DD'
+        self.codes = []                     # 列号 -> 基金代码
+        self._col = {}                      # 基金代码 -> 列号
+        self._n = 0                         # 已使用的行数
+        self._nav = np.full((0, 0), np.nan)
+        self._observed = np.zeros((0, 0), dtype=bool)
+        self._shares = np.zeros((0, 0))
+        self._flow = np.zeros((0, 0))
+        self._value = np.zeros(0)
+        self._growth = np.zeros(0)
+        self._pending = []                  # 成交日晚于最后净值日的交易 [(日期, 列, 份额, 金额)]
+        self._seen = set()                  # 已计入的交易 id
+        self.version = 0
+
+    # ---------- 矩阵维护 ----------
+    def _ensure(self, rows, cols):
+        r, c = self._nav.shape
+        if rows <= r and cols <= c: return
+        R, C = max(rows, 2 * r if rows > r else r), max(cols, 2 * c if cols > c else c)
+        def grown(arr, fill, dtype):
+            out = np.full((R, C), fill, dtype=dtype)
+            out[:r, :c] = arr
+            return out
+        self._nav = grown(self._nav, np.nan, float)
+        self._observed = grown(self._observed, False, bool)
+        self._shares = grown(self._shares, 0.0, float)
+        self._flow = grown(self._flow, 0.0, float)
+        if R > len(self._value):
+            self._value = np.concatenate([self._value, np.zeros(R - len(self._value))])
+            self._growth = np.concatenate([self._growth, np.ones(R - len(self._growth))])
+
+    def _column(self, code):
+        code = str(code)
+        col = self._col.get(code)
+        if col is None:
+            col = self._col[code] = len(self.codes)
+            self.codes.append(code)
+            self._ensure(self._n, col + 1)
+        return col
+
+    def _append_dates(self, days):
+        """在末尾追加新的净值日：净值沿用前一行、份额结转，并落地已到期的挂起交易"""
+        days = sorted(d for d in set(days) if not self.dates or d > self.dates[-1])
+        if not days: return None
+        first = self._n
+        self._ensure(self._n + len(days), len(self.codes))
+        for d in days:
+            i = self._n
+            if i:
+                self._nav[i], self._shares[i] = self._nav[i - 1], self._shares[i - 1]
+            self._flow[i] = 0.0
+            self.dates.append(d); self._n += 1
+        if self._pending:
+            keep = []
+            for d, col, ds, amt in self._pending:
+                if d > self.dates[-1]: keep.append((d, col, ds, amt)); continue
+                self._apply_tx(bisect.bisect_left(self.dates, d), col, ds, amt)
+            self._pending = keep
+        return first
+
+    def _set_navs(self, col, rows):
+        """写入真实净值并把前值填充延续到下一个真实净值之前，返回最早变动的行号"""
+        n, axis, changed = self._n, self.dates, None
+        for d, v in rows:
+            i = bisect.bisect_left(axis, d)
+            if i >= n or axis[i] != d: continue
+            self._nav[i, col], self._observed[i, col] = float(v), True
+            changed = i if changed is None else min(changed, i)
+        if changed is None: return None
+        # 前值填充：changed 之后每行取不晚于它的最近一个真实净值
+        idx = np.maximum.accumulate(np.where(self._observed[changed:n, col], np.arange(changed, n), changed))
+        self._nav[changed:n, col] = self._nav[idx, col]
+        return changed
+
+    def _apply_tx(self, row, col, ds, amt):
+        self._shares[row:self._n, col] += ds
+        self._flow[row, col] += amt
+
+    def _recompute_from(self, start):
+        """重算 [start, n) 的组合市值与时间加权收益：r_t = (V_t - 当日流入) / V_{t-1} - 1"""
+        n = self._n
+        if n == 0: return
+        lo = max(start - 1, 0)
+        F = len(self.codes)
+        vals = np.nansum(self._nav[lo:n, :F] * self._shares[lo:n, :F], axis=1)
+        self._value[lo:n] = vals
+        if start <= 0:
+            self._growth[0] = 1.0
+            start = 1
+        if start >= n: return
+        prev, cur = self._value[start - 1:n - 1], self._value[start:n]
+        inflow = self._flow[start:n, :F].sum(axis=1)
+        r = np.where(prev > 0, (cur - inflow) / np.where(prev > 0, prev, 1.0) - 1.0, 0.0)
+        self._growth[start:n] = self._growth[start - 1] * np.cumprod(1.0 + r)
+
+    # ---------- 构建与增量更新 ----------
+    @classmethod
+    def build(cls, holdings, transactions, navs, start=None):
+        """holdings: 当前持仓 DataFrame(code, shares)；transactions: 交易记录 (只计已结算)；navs: {code: [(日期, 净值)]}"""
+        with metrics.timer("analytics_seconds", stage="build"):
+            eng = cls()
+            txs = [t for t in transactions if t.get('status') == "settled"]
+            if start is None:
+                start = min([str(t.get('trade_date', "")) for t in txs] or [str(date.today() - timedelta(days=DEFAULT_LOOKBACK_DAYS))])
+            start = str(start)
+            days = sorted({d for rows in navs.values() for d, _ in rows if d >= start})
+            if not days: return eng
+            for c in list(holdings['code'].astype(str)) + [str(t['code']) for t in txs] + list(navs): eng._column(c)
+            eng._append_dates(days)
+            for c, rows in navs.items(): eng._set_navs(eng._col[str(c)], [r for r in rows if r[0] >= start])
+
+            # 起点之后的交易按成交日落到对应净值日；起点之前的交易已体现在期初份额中
+            later = np.zeros(len(eng.codes))
+            for t in txs:
+                eng._seen.add(t.get('id'))
+                d = str(t.get('trade_date', ""))
+                if d < start: continue
+                ds, amt = tx_effect(t)
+                col = eng._col[str(t['code'])]
+                later[col] += ds
+                row = bisect.bisect_left(eng.dates, d)
+                if row >= eng._n: eng._pending.append((d, col, ds, amt))
+                else: eng._apply_tx(row, col, ds, amt)
+            current = np.zeros(len(eng.codes))
+            for c, s in holdings.groupby(holdings['code'].astype(str))['shares'].sum().items(): current[eng._col[c]] = float(s)
+            opening = np.maximum(current - later, 0.0)
+            F = len(eng.codes)
+            eng._shares[:eng._n, :F] += opening
+            # 期初投入记在该基金第一个有净值的日期 (之前的行净值为空、不计市值)
+            has_nav = ~np.isnan(eng._nav[:eng._n, :F])
+            first = np.where(has_nav.any(axis=0), has_nav.argmax(axis=0), 0)
+            np.add.at(eng._flow, (first, np.arange(F)), opening * np.nan_to_num(eng._nav[first, np.arange(F)]))
+            eng._recompute_from(0)
+            eng.version += 1
+            return eng
+
+    def update_navs(self, navs):
+        """并入新的净值 {code: [(日期, 净值)]}：新日期追加到末尾，迟到/更正的净值从其日期起重算"""
+        with metrics.timer("analytics_seconds", stage="update"):
+            first = self._append_dates(d for rows in navs.values() for d, _ in rows)
+            start = first
+            for code, rows in navs.items():
+                changed = self._set_navs(self._column(code), rows)
+                if changed is not None: start = changed if start is None else min(start, changed)
+            if start is None: return False
+            self._recompute_from(start)
+            self.version += 1
+            return True
+
+    def add_transaction(self, tx):
+        """计入一笔新结算的交易；只重算其成交日之后的行"""
+        if tx.get('status') != "settled" or tx.get('id') in self._seen: return False
+        self._seen.add(tx.get('id'))
+        ds, amt = tx_effect(tx)
+        col, d = self._column(tx['code']), str(tx.get('trade_date', ""))
+        row = bisect.bisect_left(self.dates, d)
+        if row >= self._n:
+            self._pending.append((d, col, ds, amt))
+            return True
+        self._apply_tx(row, col, ds, amt)
+        self._recompute_from(row)
+        self.version += 1
+        return True
+
+    def sync(self, transactions, nav_source):
+        """把交易日志与净值库的新增部分并入：nav_source(codes, start) -> {code: [(日期, 净值)]}"""
+        added = sum(self.add_transaction(t) for t in transactions if t.get('id') not in self._seen)
+        if not self.dates: return added
+        navs = nav_source(self.codes, self.dates[max(self._n - LATE_NAV_ROWS, 0)])
+        # 已记录为真实净值的点不再重复写入
+        fresh = {}
+        for c, rows in navs.items():
+            col = self._col.get(c)
+            new = [(d, v) for d, v in rows if d > self.dates[-1] or (col is not None and not self._observed_at(d, col))]
+            if new: fresh[c] = new
+        return added + bool(fresh and self.update_navs(fresh))
+
+    def _observed_at(self, d, col):
+        i = bisect.bisect_left(self.dates, d)
+        return i < self._n and self.dates[i] == d and col < self._observed.shape[1] and bool(self._observed[i, col])
+
+    # ---------- 读数 ----------
+    def current_shares(self):
+        """回放得到的最新持有份额 (含尚未落到净值日的交易)，用于判断持仓是否被手工改动过"""
+        out = dict(zip(self.codes, self._shares[self._n - 1, :len(self.codes)] if self._n else np.zeros(len(self.codes))))
+        for _, col, ds, _ in self._pending: out[self.codes[col]] += ds
+        return out
+
+    def value_curve(self):
+        """DataFrame[总市值, 累计投入, 时间加权净值]，按净值日索引"""
+        n, F = self._n, len(self.codes)
+        return pd.DataFrame({
+            "总市值": self._value[:n], "累计投入": np.cumsum(self._flow[:n, :F].sum(axis=1)), "时间加权净值": self._growth[:n],
+        }, index=pd.to_datetime(self.dates))
+
+    def max_drawdown(self):
+        """(最大回撤, 峰值日, 谷底日)，按时间加权净值计算以排除申赎的影响"""
+        g = self._growth[:self._n]
+        if not len(g): return 0.0, None, None
+        peak = np.maximum.accumulate(g)
+        dd = g / peak - 1.0
+        trough = int(np.argmin(dd))
+        top = int(np.argmax(g[:trough + 1]))
+        return float(dd[trough]), self.dates[top], self.dates[trough]
+
+    def xirr(self):
+        n, F = self._n, len(self.codes)
+        if n == 0: return float("nan")
+        inflow = self._flow[:n, :F].sum(axis=1)
+        rows = np.flatnonzero(inflow)
+        day0 = date.fromisoformat(self.dates[0])
+        days = [(date.fromisoformat(self.dates[i]) - day0).days for i in rows] + [(date.fromisoformat(self.dates[-1]) - day0).days]
+        return xirr(days, list(-inflow[rows]) + [self._value[n - 1]])
+
+    def contributions(self):
+        """各基金在区间内的盈亏 = 期末市值 - 净投入，及其占组合总盈亏的比例"""
+        n, F = self._n, len(self.codes)
+        if n == 0: return pd.DataFrame(columns=["基金代码", "期末市值", "净投入", "盈亏", "贡献占比"])
+        end_val = np.nan_to_num(self._nav[n - 1, :F] * self._shares[n - 1, :F])
+        invested = self._flow[:n, :F].sum(axis=0)
+        pnl = end_val - invested
+        total = pnl.sum()
+        out = pd.DataFrame({"基金代码": self.codes, "期末市值": end_val, "净投入": invested, "盈亏": pnl,
+                            "贡献占比": pnl / total if total else np.zeros(F)})
+        return out.sort_values("盈亏", ascending=False, kind="stable").reset_index(drop=True)
+
+    def summary(self):
+        if self._n == 0: return {}
+        twr = float(self._growth[self._n - 1] - 1.0)
+        years = max((date.fromisoformat(self.dates[-1]) - date.fromisoformat(self.dates[0])).days, 1) / 365.0
+        mdd, peak, trough = self.max_drawdown()
+        return {"start": self.dates[0], "end": self.dates[-1], "value": float(self._value[self._n - 1]),
+                "invested": float(self._flow[:self._n, :len(self.codes)].sum()), "twr": twr,
+                "twr_annualized": (1 + twr) ** (1 / years) - 1 if twr > -1 else -1.0,
+                "xirr": self.xirr(), "max_drawdown": mdd, "drawdown_peak": peak, "drawdown_trough": trough}
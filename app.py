@@ -1,33 +1,33 @@
 import streamlit as st
 import pandas as pd
-import requests
-import json
-import os
+import numpy as np
 import time
-import re
-import random
+import uuid
+import atexit
+import threading
 from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor
+import alerts
+import bulk_import
+import fund_api
+import http_pool
+import metrics
+import nav_store
+import portfolio_store
+import quote_cache
+import settlement
+from analytics import PerformanceEngine
+from fund_directory import get_directory, lookup_name
+from intraday import IntradayRecorder
+from quote_hub import QuoteHub
+from transaction_journal import get_journal
+from valuation import calculate_dashboard_data, format_rate_column
 
 # ==========================================
 # 1. 全局配置与状态初始化
 # ==========================================
 st.set_page_config(page_title="基金实盘驾驶舱", layout="wide", page_icon="🏦")
 
-PORTFOLIO_FILE = "portfolio.json"
-TRANSACTION_FILE = "transactions.json"
-
-# 替身映射 (QDII场外无估值时，借用场内ETF行情)
-PROXY_MAP = {
-    "019005": "161226",  # 白银C -> 白银LOF
-    "019004": "161226",
-    "017437": "513100",  # 华宝纳指 -> 纳指ETF
-    "006479": "513100",
-    "016702": "513100",  # 银华海外 -> 纳指ETF (暂借)
-}
-
 # 初始化Session状态
-if 'finalized_cache' not in st.session_state: st.session_state.finalized_cache = {}
 if 'editor_key' not in st.session_state: st.session_state.editor_key = 1000
 
 # ==========================================
@@ -108,178 +108,31 @@ st.markdown("""
 # ==========================================
 # 3. 数据存取层
 # ==========================================
-def load_json(filename, default=None):
-    if default is None: default = []
-    if os.path.exists(filename):
-        try:
-            with open(filename, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except:
-            pass
-    return default
-
-def save_json(filename, data):
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
-
-def guess_confirm_days(name):
+def guess_confirm_days(name, code=None):
+    # 目录里有基金类型时按类型判断 (QDII/海外 为 T+2)，否则退回名称关键词
+    ftype = get_directory().fund_type(code) if code else ""
+    if ftype: return 2 if ("QDII" in ftype or "海外" in ftype) else 1
     if not name: return 1
     n = str(name).upper()
     keywords = ["QDII", "全球", "美国", "纳斯达克", "标普", "恒生", "海外", "油气", "商品", "德国", "日经", "越南", "印度", "法国"]
     if any(k in n for k in keywords): return 2
     return 1
 
-def load_portfolio():
-    data = load_json(PORTFOLIO_FILE, [])
-    df = pd.DataFrame(data) if data else pd.DataFrame(columns=['code', 'name', 'channel', 'cost', 'shares', 'confirm_days'])
-    for c in ['code', 'name', 'channel', 'cost', 'shares', 'confirm_days']:
-        if c not in df.columns: df[c] = ""
-    df['code'] = df['code'].astype(str).str.strip().apply(lambda x: x.zfill(6))
-    df['channel'] = df['channel'].replace([None, "nan", ""], "场外(支付宝)").astype(str)
-    df['shares'] = pd.to_numeric(df['shares'], errors='coerce').fillna(0.0)
-    df['cost'] = pd.to_numeric(df['cost'], errors='coerce').fillna(0.0)
-    df['confirm_days'] = pd.to_numeric(df['confirm_days'], errors='coerce').fillna(1).astype(int)
-    return df
-
-def save_portfolio_df(df):
-    save_list = []
-    for _, row in df.iterrows():
-        save_list.append({
-            "code": str(row['code']).zfill(6),
-            "name": str(row['name']),
-            "channel": str(row['channel']),
-            "cost": float(row['cost']),
-            "shares": float(row['shares']),
-            "confirm_days": int(row['confirm_days'])
-        })
-    save_json(PORTFOLIO_FILE, save_list)
-
-def load_transactions(): return load_json(TRANSACTION_FILE, [])
-
-def add_transaction(r):
-    h = load_transactions()
-    h.append(r)
-    save_json(TRANSACTION_FILE, h)
+# 持仓读写走 portfolio_store：文件未变化时直接复用已解析的 DataFrame，写入为原子替换
+def load_portfolio(): return portfolio_store.get_store().load()
+
+def save_portfolio_df(df): portfolio_store.get_store().save(df)
+
+# 交易记录为追加式日志 (见 transaction_journal.py)，结算/撤销只追加状态事件
+def add_transaction(r): return get_journal().add(r)
 
 # ==========================================
-# 4. 网络请求层 (云端增强版)
+# 4. 网络请求层 (实现见 fund_api.py)
 # ==========================================
-def get_headers():
-    """生成随机伪装头，防止云端被拦截"""
-    user_agents = [
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36"
-    ]
-    return {
-        "User-Agent": random.choice(user_agents),
-        "Referer": "http://fund.eastmoney.com/",
-        "Accept": "*/*"
-    }
-
-def fast_get_name(code):
-    """云端部署优化版：获取基金名称"""
-    code = str(code).zfill(6)
-    try:
-        url = f"http://fundgz.1234567.com.cn/js/{code}.js"
-        r = requests.get(url, headers=get_headers(), timeout=5)
-        if r.status_code == 200 and "jsonpgz" in r.text:
-            content = re.findall(r'jsonpgz\((.*?)\);', r.text)
-            if content:
-                data = json.loads(content[0])
-                return data.get('name', '')
-    except Exception as e:
-        print(f"Name fetch error ({code}): {e}")
-    
-    try:
-        url = f"https://fund.1234567.com.cn/fundpage/v1/info?productId={code}"
-        r = requests.get(url, headers=get_headers(), timeout=3).json()
-        if r.get("data") and r["data"].get("fund_name"):
-            return r["data"]["fund_name"]
-    except:
-        pass
-    return ""
-
-def fetch_market_rate_only(code):
-    try:
-        r = requests.get(f"http://qt.gtimg.cn/q=sh{code},sz{code}", timeout=2)
-        lines = r.text.split(';')
-        for line in lines:
-            if (f"sh{code}" in line or f"sz{code}" in line) and '="' in line:
-                parts = line.split('="')[1].split('~')
-                if len(parts) > 30:
-                    curr = float(parts[3])
-                    close = float(parts[4])
-                    if close > 0: return (curr - close) / close, "腾讯"
-    except: pass
-    try:
-        p = "1" if code.startswith(('5', '6')) else "0"
-        url = f"http://push2.eastmoney.com/api/qt/stock/get?fields=f3&secid={p}.{code}"
-        r = requests.get(url, headers=get_headers(), timeout=2).json()
-        if r.get('data') and r['data']['f3'] != "-":
-            return float(r['data']['f3']) / 100, "东财"
-    except: pass
-    return 0.0, "-"
-
-def get_previous_nav(code, today_str):
-    try:
-        url = f"http://api.fund.eastmoney.com/f10/lsjz?fundCode={code}&pageIndex=1&pageSize=5"
-        headers = {'Referer': 'http://fundf10.eastmoney.com/', 'User-Agent': 'Mozilla/5.0'}
-        r = requests.get(url, headers=headers, timeout=3)
-        data = r.json()
-        if data and 'Data' in data and 'LSJZList' in data['Data']:
-            for item in data['Data']['LSJZList']:
-                if item['FSRQ'] != today_str:
-                    return float(item['DWJZ'])
-    except: pass
-    return None
-
-@st.cache_data(ttl=1, show_spinner=False)
+# 零散查询走进程级分层缓存 (见 quote_cache.py)：有效期按数据源类型而定，行情中心每个 tick 的结果直接灌入
 def fetch_fund_data_core(fund_code, channel):
-    code = str(fund_code).zfill(6)
-    res = {"est_rate": 0.0, "base_nav": 1.0, "live_price": 1.0, "source": "-", "nav_date": ""}
-    today_str = str(datetime.now().date())
-
-    if "场内" in str(channel):
-        rate, src = fetch_market_rate_only(code)
-        if src != "-":
-            res.update({"est_rate": rate, "source": src + "(场内)", "live_price": 1.0 * (1 + rate)})
-            return res
-
-    try:
-        ts = int(time.time() * 1000)
-        url = f"http://fundgz.1234567.com.cn/js/{code}.js?rt={ts}"
-        r = requests.get(url, headers=get_headers(), timeout=5)
-        if r.status_code == 200 and "jsonpgz" in r.text:
-            content = re.findall(r'jsonpgz\((.*?)\);', r.text)
-            if content:
-                js = json.loads(content[0])
-                dwjz = float(js['dwjz'])
-                jzrq = js['jzrq']
-                if jzrq == today_str:
-                    prev_nav = get_previous_nav(code, today_str)
-                    if prev_nav and prev_nav > 0:
-                        real_rate = (dwjz - prev_nav) / prev_nav
-                        res.update({"base_nav": prev_nav, "live_price": dwjz, "est_rate": real_rate, "nav_date": jzrq, "source": "净值已更新"})
-                        return res
-                    else:
-                        res.update({"base_nav": dwjz, "live_price": dwjz, "est_rate": 0.0, "nav_date": jzrq, "source": "已更新(缺基准)"})
-                        return res
-                else:
-                    est = float(js['gszzl']) / 100
-                    res.update({"base_nav": dwjz, "live_price": dwjz * (1+est), "est_rate": est, "nav_date": jzrq, "source": "官方估值"})
-    except Exception as e: pass
-
-    target = PROXY_MAP.get(code)
-    if not target and code.startswith(('16', '15', '50', '51')): target = code
-    if "场外" in str(channel) and target:
-        if res['nav_date'] != today_str and abs(res['est_rate']) < 0.0001:
-            m_rate, m_src = fetch_market_rate_only(target)
-            if m_rate != 0:
-                res.update({"est_rate": m_rate, "source": f"借用{target}", "live_price": res['base_nav'] * (1 + m_rate)})
-
-    if res['live_price'] == 1.0 and res['base_nav'] != 1.0:
-        res['live_price'] = res['base_nav'] * (1 + res['est_rate'])
-    return res
+    get_quote_hub()  # 确保缓存已用行情中心的磁盘快照预热，重启后首屏不等上游
+    return quote_cache.get_cache().get(fund_code, channel)
 
 # ==========================================
 # 5. UI 组件封装
@@ -297,51 +150,6 @@ def render_metric_card(label, value, delta_text, is_positive):
     """
     st.markdown(html, unsafe_allow_html=True)
 
-def calculate_dashboard_data(current_df, cache_snapshot):
-    rows = []
-    t_d, t_a, t_v = 0.0, 0.0, 0.0
-    today_str = str(datetime.now().date())
-
-    def process_row(row):
-        c, ch = row['code'], row['channel']
-        cache_key = f"{c}_{today_str}"
-        cached_item = cache_snapshot.get(cache_key)
-        if cached_item:
-            d = cached_item
-            updated = True
-        else:
-            d = fetch_fund_data_core(c, ch)
-            updated = ("场外" in ch and d.get('nav_date') == today_str)
-        live, base, sh, cst = d['live_price'], d['base_nav'], float(row['shares']), float(row['cost'])
-        val = live * sh
-        day_gain = (live - base) * sh
-        acc_gain = (live - cst) * sh
-        rate_str = f"{d['est_rate'] * 100:+.2f}%" + (" (已更新)" if updated else "")
-        return {
-            "result": {
-                "基金代码": c, "基金名称": row['name'], "渠道": ch, "持仓成本": cst, "持有份额": sh,
-                "持仓金额": val, "最新净值": live, "今日盈亏": day_gain, "总盈亏": acc_gain,
-                "涨跌幅": rate_str, "数据源": d['source']
-            },
-            "stats": (day_gain, acc_gain, val),
-            "cache_update": (cache_key, d) if updated and not cached_item else None
-        }
-
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [executor.submit(process_row, row) for _, row in current_df.iterrows()]
-        for future in futures:
-            try:
-                data = future.result()
-                rows.append(data["result"])
-                dg, ag, v = data["stats"]
-                t_d += dg; t_a += ag; t_v += v
-                if data["cache_update"]:
-                    k, val = data["cache_update"]
-                    cache_snapshot[k] = val
-            except: pass
-    rows.sort(key=lambda x: x['持仓金额'], reverse=True)
-    return rows, t_d, t_a, t_v, cache_snapshot
-
 # ==========================================
 # 6. 核心 Fragment (修复 use_container_width 问题)
 # ==========================================
@@ -352,26 +160,37 @@ def sidebar_fragment():
     st.divider()
 
     with st.expander("➕ 添加新基金", expanded=False):
-        new_code = st.text_input("基金代码", key="sb_new_code", placeholder="6位数字")
+        query = st.text_input("基金代码", key="sb_new_code", placeholder="6位代码 / 名称 / 拼音首字母").strip()
+        new_code = query
+        if query and not (query.isdigit() and len(query) == 6):
+            matches = get_directory().search(query)
+            if matches:
+                pick = st.selectbox("匹配基金", matches, format_func=lambda m: f"{m['name']} ({m['code']})", key="sb_new_pick")
+                new_code = pick['code']
         new_cost = st.number_input("持仓成本价", key="sb_new_cost", value=0.0, step=0.0001, format="%.4f")
         new_shares = st.number_input("持有份额", key="sb_new_shares", value=0.0, step=0.01, format="%.2f")
 
-        fund_name = fast_get_name(new_code) if new_code.strip() else ""
+        fund_name = lookup_name(new_code) if (new_code.isdigit() and len(new_code) == 6) else ""
         if fund_name: st.success(f"已查询：{fund_name}")
-        elif new_code.strip(): st.caption("正在查询...")
+        elif new_code: st.caption("正在查询...")
 
         # 修复点：use_container_width=True -> width="stretch"
         if st.button("确认添加", width="stretch"):
-            if len(new_code.strip()) != 6: st.error("代码错误")
+            if len(new_code) != 6: st.error("代码错误")
             elif new_cost <= 0 or new_shares <= 0: st.error("数值错误")
             elif not fund_name: st.error("查询失败 (请重试)")
             else:
                 df = load_portfolio()
                 if new_code in df['code'].values: st.warning("已存在")
                 else:
-                    new_row = {"code": new_code.zfill(6), "name": fund_name, "channel": "场外(支付宝)", "cost": new_cost, "shares": new_shares, "confirm_days": guess_confirm_days(fund_name)}
+                    new_row = {"code": new_code.zfill(6), "name": fund_name, "channel": "场外(支付宝)", "cost": new_cost, "shares": new_shares, "confirm_days": guess_confirm_days(fund_name, new_code)}
                     save_portfolio_df(pd.concat([df, pd.DataFrame([new_row])], ignore_index=True))
                     st.success(f"已添加"); time.sleep(1); st.rerun()
+
+    with st.expander("📥 批量导入", expanded=False):
+        bulk_import_panel()
+    with st.expander("🔔 提醒规则", expanded=False):
+        alert_rules_panel()
     st.divider()
 
     with st.expander("💸 发起交易", expanded=False):
@@ -404,78 +223,204 @@ def sidebar_fragment():
                 st.success("✅ 已提交")
         else: st.info("请先添加基金")
 
-if 'bg_executor' not in st.session_state: st.session_state.bg_executor = ThreadPoolExecutor(max_workers=1)
+def alert_rules_panel():
+    engine = alerts.get_engine()
+    df = load_portfolio()
+    names = dict(zip(df['code'], df['name']))
+    kind = st.selectbox("类型", list(alerts.KINDS), format_func=alerts.KINDS.get, key="alert_kind")
+    if kind == "day_loss": code = "*"
+    else: code = st.selectbox("基金", ["*"] + list(names), format_func=lambda c: "全部持仓" if c == "*" else f"{names[c]} ({c})", key="alert_code")
+    threshold = st.number_input("阈值", min_value=0.0, value=2.0 if kind == "move" else 1000.0, key="alert_threshold") if kind in ("move", "day_loss") else 0.0
+    if st.button("添加规则", width="stretch", key="btn_add_alert"): engine.add_rule(kind, code, threshold)
+    for r in engine.rules():
+        c1, c2 = st.columns([5, 1])
+        target = "全部持仓" if r['code'] == "*" else names.get(r['code'], r['code'])
+        c1.caption(f"{alerts.KINDS[r['kind']]} · {target}" + (f" · {r['threshold']:g}" if r['kind'] in ("move", "day_loss") else ""))
+        if c2.button("✕", key=f"del_alert_{r['id']}"): engine.remove_rule(r['id']); st.rerun()
+    recent = engine.recent(10)
+    if recent:
+        st.caption("最近提醒")
+        for a in recent: st.caption(f"{datetime.fromtimestamp(a['ts']).strftime('%H:%M:%S')} {a['message']}")
+
+def bulk_import_panel():
+    """券商 / 支付宝导出文件：上传后整批解析校验并预览，确认后持仓或交易日志各一次写入"""
+    up = st.file_uploader("导出文件 (CSV / Excel)", type=["csv", "txt", "xlsx", "xls"], key="import_file")
+    c1, c2 = st.columns(2)
+    kind = c1.radio("内容", ["holdings", "trades"], format_func={"holdings": "持仓", "trades": "交易记录"}.get, key="import_kind")
+    source = c2.radio("来源", list(bulk_import.SOURCES), format_func={"alipay": "支付宝", "broker": "券商"}.get, key="import_source")
+    if up is None: return
+    # 同一文件 + 选项只解析一次，结果留在会话里供预览和提交
+    key = (up.file_id, kind, source)
+    res = st.session_state.get('import_result')
+    if res is None or res['key'] != key:
+        try: res = dict(bulk_import.parse(up.getvalue(), up.name, kind, source, guess_confirm_days), key=key)
+        except ValueError as e:
+            st.error(str(e)); return
+        st.session_state.import_result = res
+    rows, rejected = res['rows'], res['rejected']
+    st.caption(f"可导入 {len(rows)} 行，拒绝 {len(rejected)} 行" + ("；交易记录按已结算导入，不改动当前持仓" if kind == "trades" else "；同代码同渠道的持仓将被覆盖"))
+    if len(rejected):
+        st.dataframe(rejected, hide_index=True, height=min(len(rejected) + 1, 8) * 35 + 3)
+        st.download_button("下载拒绝明细", rejected.to_csv(index=False).encode("utf-8-sig"), "rejected.csv", "text/csv")
+    if res.get('done'):
+        st.success(res['done']); return
+    if st.button("确认导入", width="stretch", type="primary", disabled=rows.empty, key="btn_import"):
+        if kind == "holdings":
+            get_quote_hub().invalidate(bulk_import.commit_holdings(rows))
+            res['done'] = f"已导入 {len(rows)} 只持仓"
+        else:
+            added, dup = bulk_import.commit_trades(rows)
+            res['done'] = f"已导入 {added} 笔交易" + (f"，跳过重复 {dup} 笔" if dup else "")
+        st.success(res['done'])
+
+@st.cache_resource
+def get_settlement_engine():
+    return settlement.get_engine()
+
+@st.cache_resource
+def get_intraday():
+    """全进程共享的日内走势记录器，退出时把当日数据落盘"""
+    rec = IntradayRecorder()
+    atexit.register(rec.flush)
+    return rec
+
+@st.cache_resource
+def get_quote_hub():
+    """全进程共享一个行情中心，各会话只订阅、读快照"""
+    hub = QuoteHub(fund_api.fetch_fund_data_core)
+    rec = get_intraday()
+    def record_tick(data, changed):
+        # 在轮询线程中执行：快照有变化时按当前持仓估值一次，写入日内走势
+        if not changed: return
+        rows, t_d, _, t_v = calculate_dashboard_data(load_portfolio(), data)
+        rec.record(dict(zip(rows['基金代码'], rows['est_rate'])), t_v, t_d)
+        # 提醒规则跟随同一次估值在服务端判断一次，各会话只负责弹出
+        alerts.get_engine().evaluate(rows, t_d)
+    hub.add_listener(record_tick)
+    cache = quote_cache.get_cache()
+    # 磁盘快照先灌入缓存且即刻过期：peek 可立即取用，get 仍会重新拉取；第一轮 tick 后被新数据覆盖
+    seed = hub.snapshot()[2]
+    cache.absorb(seed, dict.fromkeys(seed, time.time()))
+    hub.add_listener(lambda data, changed: cache.absorb(data, hub.due_times()))
+    atexit.register(hub.shutdown)
+    return hub
+
+LIVE_COLUMNS = ["基金代码", "基金名称", "渠道", "持有份额", "持仓成本", "最新净值", "涨跌幅", "今日盈亏", "总盈亏", "持仓金额", "数据源"]
+# 数值列的显示格式交给前端按 column_config 渲染，每次下发不再经过 pandas Styler 计算整表样式
+LIVE_FORMATS = {"持有份额": "%.2f", "持仓成本": "%.4f", "最新净值": "%.4f", "今日盈亏": "%+.2f", "总盈亏": "%+.2f", "持仓金额": "%,d"}
+LIVE_COLUMN_CONFIG = {col: st.column_config.NumberColumn(col, width="small", format=LIVE_FORMATS[col]) if col in LIVE_FORMATS
+                      else st.column_config.TextColumn(col, width="small") for col in LIVE_COLUMNS}
+LIVE_COLUMN_CONFIG["基金名称"] = st.column_config.TextColumn("基金名称", width=300)
+
+def live_table(rows):
+    """只含展示列的普通 DataFrame；column_config 不支持单元格着色，涨跌方向以红/绿标记预先写进 涨跌幅 文本"""
+    # 涨跌幅文本必带 +/- 号 (含 +0.00% / -0.00%)，按符号位标记
+    mark = pd.Series(np.where(np.signbit(rows["est_rate"].to_numpy()), "🟢 ", "🔴 "), index=rows.index)
+    return rows.assign(涨跌幅=mark + format_rate_column(rows), 持仓金额=rows["持仓金额"].round())[LIVE_COLUMNS]
 
 @st.fragment(run_every=1)
 def dashboard_live_fragment():
-    now_ts = time.time()
-    if 'last_display_data' not in st.session_state: st.session_state.last_display_data = ([], 0.0, 0.0, 0.0)
-    if 'pending_future' not in st.session_state: st.session_state.pending_future = None
-    if 'last_fetch_time' not in st.session_state: st.session_state.last_fetch_time = 0
-
-    if st.session_state.pending_future:
-        if st.session_state.pending_future.done():
-            try:
-                rows, t_d, t_a, t_v, new_cache = st.session_state.pending_future.result()
-                st.session_state.last_display_data = (rows, t_d, t_a, t_v)
-                st.session_state.finalized_cache.update(new_cache)
-                st.session_state.last_fetch_time = now_ts
-            except Exception as e: print(f"Background update failed: {e}")
-            finally: st.session_state.pending_future = None
-
-    if not st.session_state.pending_future:
-        if (now_ts - st.session_state.last_fetch_time >= 4) or (not st.session_state.last_display_data[0]):
-            current_df = load_portfolio()
-            cache_snapshot = dict(st.session_state.finalized_cache)
-            future = st.session_state.bg_executor.submit(calculate_dashboard_data, current_df, cache_snapshot)
-            st.session_state.pending_future = future
-
-    rows, t_d, t_a, t_v = st.session_state.last_display_data
+    if 'session_id' not in st.session_state: st.session_state.session_id = uuid.uuid4().hex
+
+    hub = get_quote_hub()
+    current_df = load_portfolio()
+    hub.subscribe(st.session_state.session_id, zip(current_df['code'], current_df['channel']))
+
+    # 快照版本 + 持仓版本都没变时直接复用上次的估值结果与展示表，每秒重绘只剩一次 Arrow 序列化
+    version, _, quotes = hub.snapshot()
+    key = (version, portfolio_store.get_store().version, str(datetime.now().date()))
+    view = st.session_state.get('live_view')
+    if view is None or view['key'] != key:
+        rows, t_d, t_a, t_v = calculate_dashboard_data(current_df, quotes)
+        view = {"key": key, "totals": (t_d, t_a, t_v), "loading": len(rows) < len(current_df), "n": len(rows),
+                "table": live_table(rows) if not rows.empty else None}
+        st.session_state.live_view = view
+    t_d, t_a, t_v = view['totals']
+
+    # 弹出本会话还没看过的提醒；首次进入只从当前序号开始，不补弹历史
+    engine = alerts.get_engine()
+    seen = st.session_state.setdefault('alert_seq', engine.seq)
+    for a in engine.since(seen):
+        st.toast(a['message'], icon="🔔"); st.session_state.alert_seq = a['seq']
 
     c1, c2 = st.columns([8, 2])
-    c1.caption(f"⚡ 实时监控: {datetime.now().strftime('%H:%M:%S')}")
+    # 重启后首屏来自磁盘快照：后台第一轮刷新完成前标记为缓存数据
+    if hub.stale_pairs(zip(current_df['code'], current_df['channel'])):
+        c1.caption(f"🕘 缓存快照 ({datetime.fromtimestamp(hub.updated_at).strftime('%m-%d %H:%M:%S')})，后台刷新中...")
+    else: c1.caption(f"⚡ 实时监控: {datetime.now().strftime('%H:%M:%S')}")
     k1, k2, k3 = st.columns(3)
     with k1: render_metric_card("今日盈亏", f"{t_d:+.2f}", "今日波动", t_d >= 0)
     with k2: render_metric_card("历史盈亏", f"{t_a:+.2f}", "累计收益", t_a >= 0)
     with k3: render_metric_card("总资产", f"{t_v:,.0f}", "当前市值", True)
     
     st.write("")
-    if not rows:
-        if st.session_state.pending_future: st.info("🚀 正在极速加载数据...")
+    if view['table'] is None:
+        if view['loading']: st.info("🚀 正在极速加载数据...")
         else: st.info("暂无持仓，请在左侧添加基金。")
         return
 
-    df = pd.DataFrame(rows)
-    def color_val(val):
-        return f'color: #ff4d4f; font-weight: bold' if val > 0 else f'color: #2cc995; font-weight: bold' if val < 0 else 'color: #e0e0e0'
-    all_columns = ["基金代码", "基金名称", "渠道", "持有份额", "持仓成本", "最新净值", "涨跌幅", "今日盈亏", "总盈亏", "持仓金额", "数据源"]
-    col_config = {col: st.column_config.TextColumn(col, width="small") for col in all_columns}
-    col_config["基金名称"] = st.column_config.TextColumn("基金名称", width=300)
-    col_config["数据源"] = st.column_config.TextColumn("数据源", width="small")
-
     st.dataframe(
-        df.style.set_table_styles([{'selector': 'th', 'props': [('text-align', 'left'), ('border-bottom', '1px solid #41424b !important'), ('background-color', '#1e1e1e !important')]}, {'selector': 'td', 'props': [('text-align', 'left')]}])
-        .map(color_val, subset=['今日盈亏', '总盈亏'])
-        .map(lambda x: 'color: #ff4d4f; font-weight:bold' if "+" in str(x) else 'color: #2cc995; font-weight:bold' if "-" in str(x) else 'color:#888' if "更新" in str(x) else 'color: #e0e0e0', subset=['涨跌幅'])
-        .format({"持仓成本": "{:.4f}", "持有份额": "{:.2f}", "持仓金额": "{:,.0f}", "最新净值": "{:.4f}", "今日盈亏": "{:+.2f}", "总盈亏": "{:+.2f}"}),
+        view['table'],
         # 修复点：use_container_width=True -> width="stretch"
         width="stretch", 
-        height=(len(df) + 1) * 35 + 3, hide_index=True, column_order=all_columns, column_config=col_config
+        height=(view['n'] + 1) * 35 + 3, hide_index=True, column_order=LIVE_COLUMNS, column_config=LIVE_COLUMN_CONFIG
     )
+    if st.toggle("📈 日内走势", key="intraday_toggle"): render_intraday(current_df)
+
+def render_intraday(current_df):
+    rec = get_intraday()
+    names = dict(zip(current_df['code'], current_df['name']))
+    picked = st.multiselect("基金涨跌幅走势", list(names), default=list(names)[:3], format_func=lambda c: f"{names[c]} ({c})", key="intraday_codes")
+    # 记录器版本与所选基金不变时复用上次的降采样结果
+    key = (rec.version, tuple(picked))
+    cached = st.session_state.get('intraday_view')
+    if cached is None or cached[0] != key:
+        cached = (key, rec.portfolio_series(), rec.fund_series(picked))
+        st.session_state.intraday_view = cached
+    _, port, funds = cached
+    if port.empty:
+        st.caption("今日暂无走势数据")
+        return
+    c1, c2 = st.columns(2)
+    c1.caption("组合总市值"); c1.line_chart(port["总市值"], height=220)
+    c2.caption("今日盈亏"); c2.line_chart(port["今日盈亏"], height=220)
+    if not funds.empty:
+        st.caption("涨跌幅 (%)")
+        st.line_chart(funds.rename(columns=names), height=260)
+
+def apply_portfolio_edits():
+    """data_editor 的 on_change：把行级增量 (修改/新增/删除) 直接补丁到持仓存储，不做整表比较，不发网络请求。
+    只有新出现的 (代码, 渠道) 交给行情中心立即重拉，份额/成本等修改由实时视图按持仓版本本地重算"""
+    delta = st.session_state.get("portfolio_editor") or {}
+    added = [dict(r, name=r.get('name') or get_directory().name(str(r['code']).strip().zfill(6)))
+             for r in delta.get('added_rows', []) if str(r.get('code') or "").strip()]
+    store = portfolio_store.get_store()
+    before = store.version
+    try: new_pairs = store.patch(delta.get('edited_rows'), added, delta.get('deleted_rows'), st.session_state.get('editor_base'))
+    except Exception as e:
+        st.session_state.editor_error = f"保存失败: {e}"; return
+    if new_pairs is None:
+        st.session_state.editor_error = "持仓已在别处更新，已载入最新数据，请重新编辑"; return
+    if new_pairs:
+        hub, df = get_quote_hub(), store.load()
+        if 'session_id' in st.session_state: hub.subscribe(st.session_state.session_id, zip(df['code'], df['channel']))
+        hub.invalidate(new_pairs)
+    # 没有新代码的修改同样返回空集合，是否真正写盘看持仓版本
+    if store.version != before: st.toast("✅ 持仓已更新", icon="💾")
 
 def dashboard_edit_fragment():
     current_df = load_portfolio()
-    if 'finalized_cache' not in st.session_state: st.session_state.finalized_cache = {}
-    cache_snapshot = dict(st.session_state.finalized_cache)
-    rows, t_d, t_a, t_v, _ = calculate_dashboard_data(current_df, cache_snapshot)
 
     st.caption("✏️ 编辑模式: 直接修改下方表格，修改后自动保存。")
+    if 'editor_error' in st.session_state: st.error(st.session_state.pop('editor_error'))
     if current_df.empty:
         st.info("暂无持仓数据，请在侧边栏添加。")
         return
     
+    # 行号相对于渲染时的持仓版本；保存后数据变化，编辑器随之以新数据重建、增量清零
+    st.session_state.editor_base = portfolio_store.get_store().version
     table_height = (len(current_df) + 2) * 35 + 3
-    edited_df = st.data_editor(
+    st.data_editor(
         current_df,
         column_config={
             "code": "基金代码", "name": "基金名称",
@@ -488,61 +433,162 @@ def dashboard_edit_fragment():
         hide_index=True, 
         # 修复点：use_container_width=True -> width="stretch"
         width="stretch", 
-        height=table_height, num_rows="dynamic", key="portfolio_editor"
+        height=table_height, num_rows="dynamic", key="portfolio_editor", on_change=apply_portfolio_edits
     )
 
-    if not edited_df.equals(current_df):
-        try:
-            edited_df = edited_df[edited_df["code"].notna() & (edited_df["code"] != "")]
-            save_portfolio_df(edited_df)
-            st.toast("✅ 持仓已更新", icon="💾"); time.sleep(0.5); st.rerun()
-        except Exception as e: st.error(f"保存失败: {e}")
+def reference_price(code, channel):
+    """手动结算时的参考价：行情缓存 (含行情中心快照) > 本地最新净值 > 1.0 (不在页面线程发网络请求)"""
+    quote = quote_cache.get_cache().peek(code, channel) or get_quote_hub().snapshot()[2].get((code, channel))
+    if quote: return float(quote['live_price'])
+    return nav_store.get_store().latest_nav(code) or 1.0
 
 def transaction_manager_fragment():
     st.subheader("交易管理")
-    trans = load_transactions()
-    pend = [t for t in trans if t['status'] == 'pending']
+    journal, engine = get_journal(), get_settlement_engine()
+    if st.toggle("🤖 自动结算", key="auto_settle", help="到期且成交日净值已公布的场外交易自动按官方净值结算"):
+        res = engine.maybe_auto()
+        if res and res['settled']: st.toast(f"自动结算 {len(res['settled'])} 笔", icon="🤖")
+    pend = journal.pending()
     if not pend:
-        st.info("🎉 暂无待处理交易"); return
+        st.info("🎉 暂无待处理交易"); render_settlement_history(engine); return
     now = str(datetime.now().date())
+    # 到期交易的成交日净值一次批量查询；页面展示时同步受节流限制，点击结算时才强制拉取
+    ready, skipped = engine.preview(now, force=False)
+    resolved = {t['id']: nav for t, nav in ready}
+    reasons = {t['id']: r for t, r in skipped}
+    if st.button(f"⚡ 一键结算 ({len(ready)} 笔可按官方净值结算)", type="primary", disabled=not journal.due(now), key="btn_settle_all"):
+        res = engine.settle(now)
+        st.toast(f"结算完成 {len(res['settled'])} 笔，跳过 {len(res['skipped'])} 笔"); time.sleep(1); st.rerun()
+
     cols = st.columns([3, 1, 2, 1, 1])
-    cols[0].caption("标的/方向"); cols[1].caption("状态"); cols[2].caption("预估详情"); cols[3].caption("结算"); cols[4].caption("撤销")
-    
+    cols[0].caption("标的/方向"); cols[1].caption("状态"); cols[2].caption("成交净值"); cols[3].caption("结算"); cols[4].caption("撤销")
     for i, t in enumerate(pend):
         c1, c2, c3, c4, c5 = st.columns([3, 1, 2, 1, 1])
         color = "red" if t['type'] == 'buy' else "green"
         c1.markdown(f"**{t['name']}** :{color}[{t['type']}]")
         c1.caption(f"{t['channel']} | {t['trade_date']}")
-        ready = now >= t['confirm_date']
-        if ready: c2.success("✅ 可结算")
+        ready_now = now >= t['confirm_date']
+        if ready_now: c2.success("✅ 可结算")
         else: c2.info(f"⏳ {t['confirm_date']}")
         unit = "元" if t['mode'] == 'amount' else "份"
-        c3.caption(f"委托: {t['value']} {unit}")
-        rt = fetch_fund_data_core(t['code'], t['channel'])
-        if ready:
-            rp = c3.number_input(f"净#{i}", value=float(rt['live_price']), format="%.4f", label_visibility="collapsed")
-            if c4.button("确认", key=f"btn_ok_{i}"):
-                pdf = load_portfolio()
-                matches = pdf[pdf['code'] == t['code']]
-                if matches.empty:
-                    new_row = {"code": t['code'], "name": t['name'], "channel": t['channel'], "cost": 0.0, "shares": 0.0, "confirm_days": 1}
-                    pdf = pd.concat([pdf, pd.DataFrame([new_row])], ignore_index=True); idx = len(pdf)-1
-                else: idx = matches.index[0]
-                cur = pdf.loc[idx]
-                fs = float(t['value'])/rp if t['mode'] == "amount" else float(t['value'])
-                fa = float(t['value']) if t['mode'] == "amount" else float(t['value'])*rp
-                if t['type'] == 'buy':
-                    ns = float(cur['shares']) + fs
-                    nc = (float(cur['shares'])*float(cur['cost']) + fa)/ns if ns>0 else 0
-                    pdf.at[idx, 'shares'], pdf.at[idx, 'cost'] = ns, nc
-                else:
-                    ns = float(cur['shares']) - fs
-                    pdf.at[idx, 'shares'] = ns if ns>0 else 0
-                save_portfolio_df(pdf); save_json(TRANSACTION_FILE, [x for x in trans if x != t])
+        c3.caption(f"委托: {t['value']} {unit}" + (f" · 官方净值 {resolved[t['id']]:.4f}" if t['id'] in resolved else f" · {reasons[t['id']]}" if t['id'] in reasons else ""))
+        if ready_now:
+            rp = c3.number_input(f"净#{i}", value=float(resolved.get(t['id']) or reference_price(t['code'], t['channel'])), format="%.4f", label_visibility="collapsed")
+            if c4.button("确认", key=f"btn_ok_{t['id']}"):
+                # 未改动官方净值时不作为手动指定，仍由结算引擎按成交日校验后取净值
+                engine.settle(now, tx_ids=[t['id']], overrides=None if rp == resolved.get(t['id']) else {t['id']: rp})
                 st.toast("结算完成"); time.sleep(1); st.rerun()
         else: c4.write("-")
-        if c5.button("🗑️", key=f"btn_del_{i}"):
-            save_json(TRANSACTION_FILE, [x for x in trans if x != t]); st.toast("已撤销"); time.sleep(0.5); st.rerun()
+        if c5.button("🗑️", key=f"btn_del_{t['id']}"):
+            journal.set_status(t['id'], "cancelled"); st.toast("已撤销"); time.sleep(0.5); st.rerun()
+    render_settlement_history(engine)
+
+def render_settlement_history(engine):
+    batches = engine.history()
+    if not batches: return
+    with st.expander("📜 结算记录", expanded=False):
+        rows = [{"时间": datetime.fromtimestamp(b['ts']).strftime("%m-%d %H:%M"), "方式": "自动" if b['mode'] == "auto" else "手动",
+                 "基金": f"{it['name']} ({it['code']})", "方向": it['type'], "成交日": it['trade_date'], "净值": it['nav'],
+                 "份额": it['shares'], "金额": it['amount'], "结算后份额": it['after'][0]} for b in batches for it in b['items']]
+        st.dataframe(pd.DataFrame(rows).style.format({"净值": "{:.4f}", "份额": "{:,.2f}", "金额": "{:,.2f}", "结算后份额": "{:,.2f}"}),
+                     hide_index=True, width="stretch")
+
+@st.cache_resource
+def get_analytics_state():
+    """全进程共享的业绩回放引擎；持仓或起始日变化时重建，其余情况只增量并入新交易和新净值"""
+    return {"lock": threading.Lock(), "engine": None, "start": None, "holdings_version": None}
+
+def analytics_fragment():
+    st.subheader("业绩分析")
+    journal, store = get_journal(), nav_store.get_store()
+    holdings = load_portfolio()
+    settled = journal.by_status("settled")
+    default_start = min([t['trade_date'] for t in settled] or [str(datetime.now().date() - timedelta(days=365))])
+    c1, c2 = st.columns([3, 1])
+    start = str(c1.date_input("起始日期", value=datetime.strptime(default_start, "%Y-%m-%d").date(), key="perf_start"))
+    codes = list(dict.fromkeys(list(holdings['code']) + [t['code'] for t in settled]))
+    if c2.button("⬇️ 补全历史净值", key="perf_backfill"):
+        with st.spinner("正在拉取历史净值..."):
+            http_pool.fan_out(lambda c: store.backfill(c, fund_api.fetch_nav_history, start), [(c,) for c in codes])
+        get_analytics_state()['engine'] = None
+
+    state = get_analytics_state()
+    with state['lock']:
+        eng, version = state['engine'], portfolio_store.get_store().version
+        if eng is not None and state['start'] == start:
+            eng.sync(settled, store.history_many)
+            if version != state['holdings_version']:
+                # 持仓被手工改动 (与回放结果不一致) 时期初份额失效，需要重建
+                replay = eng.current_shares()
+                actual = holdings.groupby('code')['shares'].sum()
+                if any(abs(replay.get(c, 0.0) - float(v)) > 1e-6 for c, v in actual.items()): eng = None
+        if eng is None or state['start'] != start:
+            eng = PerformanceEngine.build(holdings, settled, store.history_many(codes, start), start=start)
+        state.update(engine=eng, start=start, holdings_version=version)
+        summary, curve, contrib = eng.summary(), eng.value_curve(), eng.contributions()
+
+    if not summary:
+        st.info("本地暂无历史净值，请点击「补全历史净值」"); return
+    pct = lambda v: "-" if v != v else f"{v:+.2%}"
+    k = st.columns(5)
+    k[0].metric("期末市值", f"{summary['value']:,.0f}")
+    k[1].metric("时间加权收益", pct(summary['twr']))
+    k[2].metric("年化 (TWR)", pct(summary['twr_annualized']))
+    k[3].metric("XIRR", pct(summary['xirr']))
+    k[4].metric("最大回撤", pct(summary['max_drawdown']), help=f"{summary['drawdown_peak']} → {summary['drawdown_trough']}")
+    st.caption(f"区间 {summary['start']} ~ {summary['end']}")
+    l, r = st.columns(2)
+    l.caption("市值 / 累计投入"); l.line_chart(curve[["总市值", "累计投入"]], height=260)
+    r.caption("时间加权净值"); r.line_chart(curve["时间加权净值"], height=260)
+    names = dict(zip(holdings['code'], holdings['name']))
+    contrib.insert(1, "基金名称", [names.get(c) or lookup_name(c) for c in contrib['基金代码']])
+    st.caption("各基金盈亏贡献")
+    st.dataframe(contrib.style.format({"期末市值": "{:,.2f}", "净投入": "{:,.2f}", "盈亏": "{:+,.2f}", "贡献占比": "{:.1%}"}),
+                 hide_index=True, width="stretch")
+
+def diagnostics_fragment():
+    st.subheader("数据源诊断")
+    st.button("🔄 刷新指标", key="diag_refresh")
+    ms = lambda s: round(s * 1000, 1)
+
+    reqs = {tuple(v for _, v in k): n for k, n in metrics.counters("http_requests_total").items()}
+    lat = {h['labels']['host']: h for h in metrics.histograms("http_request_seconds")}
+    breakers = http_pool.breaker_states()
+    hosts = sorted({h for h, _ in reqs} | set(lat))
+    if hosts:
+        st.caption("上游请求")
+        st.dataframe(pd.DataFrame([{
+            "上游": h, "请求数": sum(reqs.get((h, o), 0) for o in ("ok", "timeout", "error")),
+            "超时": reqs.get((h, "timeout"), 0), "错误": reqs.get((h, "error"), 0),
+            "熔断": breakers.get(h, ("closed", 0))[0], "熔断拒绝": reqs.get((h, "rejected"), 0),
+            "平均(ms)": ms(lat.get(h, {}).get('avg', 0)), "P50≤(ms)": ms(lat.get(h, {}).get('p50', 0)), "P95≤(ms)": ms(lat.get(h, {}).get('p95', 0)),
+        } for h in hosts]), hide_index=True, width="stretch")
+    else: st.info("暂无上游请求记录")
+
+    c1, c2 = st.columns(2)
+    with c1:
+        st.caption("降级 / 吞掉的异常")
+        fb = [{"类型": f"降级 {dict(k)['path']}", "次数": n} for k, n in metrics.counters("fallback_total").items()]
+        fb += [{"类型": f"异常 {dict(k)['source']}", "次数": n} for k, n in metrics.counters("fetch_errors_total").items()]
+        fb += [{"类型": f"对冲 {dict(k)['path']} → {dict(k)['winner']}", "次数": n} for k, n in metrics.counters("hedge_total").items()]
+        st.dataframe(pd.DataFrame(fb, columns=["类型", "次数"]), hide_index=True, width="stretch")
+    with c2:
+        st.caption("缓存命中率")
+        hits = {}
+        for k, n in metrics.counters("cache_requests_total").items():
+            d = dict(k); hits.setdefault(d['cache'], [0, 0])[d['result'] == "miss"] += n
+        st.dataframe(pd.DataFrame([{"缓存": c, "命中": h, "未命中": m, "命中率": f"{h / (h + m):.1%}" if h + m else "-"} for c, (h, m) in sorted(hits.items())],
+                                  columns=["缓存", "命中", "未命中", "命中率"]), hide_index=True, width="stretch")
+
+    st.caption("刷新周期耗时")
+    cycles = [{"阶段": name, "次数": h['count'], "平均(ms)": ms(h['avg']), "P50≤(ms)": ms(h['p50']), "P95≤(ms)": ms(h['p95'])}
+              for name in ("refresh_cycle_seconds", "calculate_dashboard_seconds", "analytics_seconds") for h in metrics.histograms(name)]
+    st.dataframe(pd.DataFrame(cycles, columns=["阶段", "次数", "平均(ms)", "P50≤(ms)", "P95≤(ms)"]), hide_index=True, width="stretch")
+
+    with st.expander("Prometheus 文本", expanded=False):
+        text = metrics.prometheus_text()
+        st.download_button("下载 metrics.txt", text, file_name="metrics.txt", key="diag_download")
+        st.code(text, language="text")
 
 # ==========================================
 # 7. 页面主入口
@@ -551,8 +597,10 @@ with st.sidebar:
     sidebar_fragment()
 
 st.title("🏦 基金实盘驾驶舱")
-tab1, tab2 = st.tabs(["📊 资产全览", "📝 交易管理"])
+tab1, tab2, tab3, tab4 = st.tabs(["📊 资产全览", "📝 交易管理", "📈 业绩分析", "🩺 诊断"])
 with tab1:
     if st.session_state.get("edit_mode_toggle", False): dashboard_edit_fragment()
     else: dashboard_live_fragment()
 with tab2: transaction_manager_fragment()
+with tab3: analytics_fragment()
+with tab4: diagnostics_fragment()
@@ -0,0 +1,152 @@
+import json
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+# ==========================================
+# 本地替身上游：模拟 fundgz / qt.gtimg / push2 / lsjz / 重仓股
+# ==========================================
+# 以 HTTP 正向代理的方式运行：设置 HTTP_PROXY 指向本服务后，fund_api 里写死的上游地址原样可用，
+# 按请求的 Host 分发到对应的模拟接口，并按主机统计请求数。
+# 重仓股接口是 HTTPS，代理无法明文转发，use_mock_holdings() 把它改成同一主机的 HTTP 地址交给替身处理。
+FUNDGZ, GTIMG, PUSH2, LSJZ = "fundgz.1234567.com.cn", "qt.gtimg.cn", "push2.eastmoney.com", "api.fund.eastmoney.com"
+FUNDMOB = "fundmobapi.eastmoney.com"
+
+@dataclass
+class UpstreamConfig:
+    latency_ms: float = 30.0      # 每个请求的基础延迟
+    jitter_ms: float = 10.0       # 延迟的随机抖动 (±)
+    error_rate: float = 0.0       # 返回 500 的比例
+    timeout_rate: float = 0.0     # 挂起 hang_s 秒 (超过客户端超时) 的比例
+    hang_s: float = 6.0
+    finalized_ratio: float = 0.0  # fundgz 返回 jzrq=今天 (净值已更新) 的基金比例
+    no_estimate_ratio: float = 0.0  # fundgz 返回空报文 jsonpgz(); (无官方估值，走重仓股估算) 的基金比例
+    host_latency_ms: dict = field(default_factory=dict)  # 按主机覆盖基础延迟，模拟单个上游变慢
+
+def _seed(code): return zlib.crc32(str(code).encode())
+
+def _nav(code, day=None):
+    base = 1.0 + (_seed(code) % 2000) / 1000
+    if day is None: return base
+    return round(base * (1 + ((_seed(f"{code}{day}") % 400) - 200) / 10000), 4)
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args): pass
+
+    def do_GET(self):
+        up = self.server.upstream
+        parts = urlsplit(self.path)
+        host = parts.hostname or (self.headers.get("Host") or "").split(":")[0]
+        up.count(host)
+        cfg = up.config
+        r = random.random()
+        delay = cfg.host_latency_ms.get(host, cfg.latency_ms) + random.uniform(-cfg.jitter_ms, cfg.jitter_ms)
+        if r < cfg.timeout_rate: delay = cfg.hang_s * 1000
+        time.sleep(max(delay, 0) / 1000)
+        if cfg.timeout_rate <= r < cfg.timeout_rate + cfg.error_rate:
+            return self._send(500, "upstream error")
+        route = {FUNDGZ: self._fundgz, GTIMG: self._gtimg, PUSH2: self._push2, LSJZ: self._lsjz, FUNDMOB: self._holdings}.get(host)
+        if route is None: return self._send(404, "not found")
+        try: self._send(200, route(parts.path, parse_qs(parts.query), cfg))
+        except Exception as e: self._send(500, f"mock error: {e}")
+
+    def _send(self, status, body):
+        raw = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    # ---------- 各上游的报文形状 ----------
+    def _fundgz(self, path, qs, cfg):
+        code = path.rsplit("/", 1)[-1].split(".")[0]
+        if (_seed(f"{code}gz") % 1000) < cfg.no_estimate_ratio * 1000: return "jsonpgz();"
+        today = date.today()
+        finalized = (_seed(code) % 1000) < cfg.finalized_ratio * 1000
+        jzrq = today if finalized else today - timedelta(days=1)
+        dwjz = _nav(code, jzrq)
+        gszzl = ((_seed(f"{code}{time.time() // 60}") % 600) - 300) / 100
+        js = {"fundcode": code, "name": f"模拟基金{code}", "jzrq": str(jzrq), "dwjz": f"{dwjz:.4f}",
+              "gsz": f"{dwjz * (1 + gszzl / 100):.4f}", "gszzl": f"{gszzl:.2f}", "gztime": datetime.now().strftime("%Y-%m-%d %H:%M")}
+        return f"jsonpgz({json.dumps(js, ensure_ascii=False)});"
+
+    def _gtimg(self, path, qs, cfg):
+        symbols = path.split("q=", 1)[-1].split(",")
+        out = []
+        for sym in symbols:
+            code, market = sym[2:], sym[:2]
+            if market != ("sh" if code.startswith(("5", "6")) else "sz"):
+                out.append('v_pv_none_match="1";'); continue
+            close = _nav(code)
+            curr = round(close * (1 + ((_seed(f"{code}{time.time() // 10}") % 400) - 200) / 10000), 3)
+            fields = ["1", f"模拟{code}", code, f"{curr}", f"{close}"] + ["0"] * 40
+            out.append(f'v_{sym}="{"~".join(fields)}";')
+        return "\n".join(out)
+
+    def _push2(self, path, qs, cfg):
+        secids = (qs.get("secids") or qs.get("secid") or [""])[0].split(",")
+        diff = [{"f3": (_seed(s) % 400) - 200, "f12": s.split(".")[-1]} for s in secids if s]
+        return json.dumps({"rc": 0, "data": {"total": len(diff), "diff": diff}})
+
+    def _lsjz(self, path, qs, cfg):
+        code = qs.get("fundCode", [""])[0]
+        page, size = int(qs.get("pageIndex", ["1"])[0]), int(qs.get("pageSize", ["20"])[0])
+        end = date.fromisoformat(qs["endDate"][0]) if qs.get("endDate", [""])[0] else date.today()
+        start = date.fromisoformat(qs["startDate"][0]) if qs.get("startDate", [""])[0] else end - timedelta(days=60)
+        days = [end - timedelta(days=i) for i in range((end - start).days + 1)]
+        days = [d for d in days if d.weekday() < 5]
+        rows = [{"FSRQ": str(d), "DWJZ": f"{_nav(code, d):.4f}", "LJJZ": ""} for d in days]
+        return json.dumps({"Data": {"LSJZList": rows[(page - 1) * size: page * size]}, "TotalCount": len(rows), "PageIndex": page, "PageSize": size})
+
+    def _holdings(self, path, qs, cfg):
+        """前十大重仓股：按代码固定生成沪深股票，行情由 _gtimg 提供"""
+        code = qs.get("FCODE", [""])[0]
+        stocks = [{"GPDM": f"{'600' if i % 2 else '000'}{(_seed(f'{code}{i}') % 1000):03d}", "GPJC": f"模拟股{i}",
+                   "JZBL": f"{2 + _seed(f'{code}w{i}') % 800 / 100:.2f}", "NEWTEXCH": ""} for i in range(10)]
+        return json.dumps({"Datas": {"fundStocks": stocks}, "Expansion": str(date.today().replace(day=1))}, ensure_ascii=False)
+
+def use_mock_holdings():
+    """重仓股接口改走 HTTP，使其经 HTTP_PROXY 到达替身上游"""
+    import fund_api
+    fund_api.HOLDINGS_URL = fund_api.HOLDINGS_URL.replace("https://", "http://", 1)
+
+class MockUpstream:
+    """在后台线程里运行的替身上游；proxy_url 供 HTTP_PROXY 使用"""
+
+    def __init__(self, config=None, port=0):
+        self.config = config or UpstreamConfig()
+        self._counts, self._lock = Counter(), threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self.server.daemon_threads = True
+        self.server.upstream = self
+        self._thread = None
+
+    @property
+    def proxy_url(self): return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def count(self, host):
+        with self._lock: self._counts[host] += 1
+
+    def counts(self, reset=False):
+        with self._lock:
+            out = dict(self._counts)
+            if reset: self._counts.clear()
+        return out
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mock-upstream", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,162 @@
+"""刷新链路基准测试：在本地替身上游上按不同持仓规模测量刷新耗时与请求数。
+
+    python bench/run_bench.py --sizes 10,100,1000,5000 --iterations 5 --latency-ms 30
+    python bench/run_bench.py --sizes 100 --error-rate 0.05 --slow-host fundgz.1234567.com.cn=800
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_upstream import MockUpstream, UpstreamConfig, use_mock_holdings  # noqa: E402
+
+def make_portfolio(n, seed=0):
+    """约 70% 场外、20% 场内 ETF/LOF，其余为 PROXY_MAP 里借用替身行情的 QDII"""
+    import fund_api
+    from portfolio_store import normalize_portfolio
+    rng = random.Random(seed)
+    proxied = list(fund_api.PROXY_MAP)
+    records, seen = [], set()
+    while len(records) < n:
+        r = rng.random()
+        if r < 0.1 and not seen.issuperset(proxied): code, ch = rng.choice(proxied), "场外(支付宝)"
+        elif r < 0.3: code, ch = f"{rng.choice(['51', '15', '16'])}{rng.randrange(10**4):04d}", "场内(证券)"
+        else: code, ch = f"{rng.choice(['0', '1', '2'])}{rng.randrange(10**5):05d}", "场外(支付宝)"
+        if code in seen: continue
+        seen.add(code)
+        records.append({"code": code, "name": f"模拟基金{code}", "channel": ch, "cost": round(rng.uniform(0.8, 2.5), 4),
+                        "shares": round(rng.uniform(100, 50000), 2), "confirm_days": 1})
+    return normalize_portfolio(records)
+
+def summarize(samples_s):
+    ms = np.asarray(samples_s) * 1000
+    if not len(ms): return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2)}
+
+def timed(fn, *args):
+    t = time.perf_counter()
+    out = fn(*args)
+    return time.perf_counter() - t, out
+
+def bench_refresh(upstream, df, iterations):
+    """QuoteHub 一个 tick (批量行情 + 扇出拉取) + 向量化估值；强制全量拉取，不受交易时段调度影响"""
+    import fund_api
+    from quote_hub import QuoteHub
+    from valuation import calculate_dashboard_data
+    fund_api._quote_book.clear()
+    hub = QuoteHub()
+    pairs = set(zip(df['code'], df['channel']))
+    cold, samples, reqs = None, [], []
+    for i in range(iterations + 1):
+        upstream.counts(reset=True)
+        elapsed, data = timed(hub.refresh, pairs, True)
+        calc_s, _ = timed(calculate_dashboard_data, df, data)
+        if i == 0: cold = elapsed + calc_s; continue
+        samples.append(elapsed + calc_s)
+        reqs.append(sum(upstream.counts().values()))
+    # 按调度的常规 tick：只拉取到期的基金
+    upstream.counts(reset=True)
+    hub.refresh(pairs)
+    scheduled = sum(upstream.counts().values())
+    return dict(summarize(samples), cold_ms=round(cold * 1000, 2), req_per_refresh=round(float(np.mean(reqs)), 1) if reqs else 0.0,
+                req_scheduled=scheduled)
+
+def bench_fetch_core(upstream, df, limit=50):
+    """逐只调用 fetch_fund_data_core 的单次延迟 (不经批量预取)"""
+    import fund_api
+    fund_api._quote_book.clear()
+    sample = df.head(limit)
+    upstream.counts(reset=True)
+    samples = [timed(fund_api.fetch_fund_data_core, c, ch)[0] for c, ch in zip(sample['code'], sample['channel'])]
+    return dict(summarize(samples), req_per_call=round(sum(upstream.counts().values()) / max(len(sample), 1), 2))
+
+def bench_persistence(df, iterations):
+    """持仓读写、交易日志追加/结算/查询"""
+    from portfolio_store import PortfolioStore
+    from transaction_journal import TransactionJournal
+    out = {}
+    store = PortfolioStore("bench_portfolio.json")
+    out['portfolio_save'] = summarize([timed(store.save, df)[0] for _ in range(iterations)])
+    out['portfolio_load_warm'] = summarize([timed(store.load)[0] for _ in range(iterations)])
+    out['portfolio_load_cold'] = summarize([timed(PortfolioStore("bench_portfolio.json").load)[0] for _ in range(iterations)])
+    journal = TransactionJournal("bench_transactions.jsonl", legacy_path=None)
+    tx = {"submit_date": "2026-01-05", "trade_date": "2026-01-05", "confirm_date": "2026-01-06", "code": df['code'].iloc[0],
+          "name": "bench", "type": "buy", "mode": "amount", "value": 1000.0, "status": "pending", "channel": "场外(支付宝)"}
+    ids = []
+    add_s = []
+    for _ in range(len(df)):
+        s, tx_id = timed(journal.add, tx)
+        add_s.append(s); ids.append(tx_id)
+    out['journal_add'] = summarize(add_s)
+    out['journal_settle'] = summarize([timed(journal.set_status, i, "settled")[0] for i in ids[: max(len(ids) // 2, 1)]])
+    out['journal_pending'] = summarize([timed(journal.pending)[0] for _ in range(iterations)])
+    return out
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sizes", default="10,100,1000,5000")
+    ap.add_argument("--iterations", type=int, default=5)
+    ap.add_argument("--latency-ms", type=float, default=30.0)
+    ap.add_argument("--jitter-ms", type=float, default=10.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--timeout-rate", type=float, default=0.0)
+    ap.add_argument("--finalized-ratio", type=float, default=0.0, help="fundgz 返回今日净值的比例 (盘后场景)")
+    ap.add_argument("--no-estimate-ratio", type=float, default=0.0, help="fundgz 无官方估值、需按重仓股估算的基金比例")
+    ap.add_argument("--slow-host", action="append", default=[], metavar="HOST=MS", help="单独放慢某个上游")
+    ap.add_argument("--skip", default="", help="跳过的项目，逗号分隔: refresh,fetch_core,persistence")
+    ap.add_argument("--json", help="结果另存为 JSON")
+    args = ap.parse_args(argv)
+
+    cfg = UpstreamConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                         timeout_rate=args.timeout_rate, finalized_ratio=args.finalized_ratio,
+                         no_estimate_ratio=args.no_estimate_ratio,
+                         host_latency_ms={h: float(ms) for h, ms in (s.split("=", 1) for s in args.slow_host)})
+    upstream = MockUpstream(cfg).start()
+    os.environ.update({"HTTP_PROXY": upstream.proxy_url, "http_proxy": upstream.proxy_url, "NO_PROXY": "", "no_proxy": ""})
+    use_mock_holdings()
+    skip = set(filter(None, args.skip.split(",")))
+    # 本地库 (净值库/持仓/交易日志) 全部落在临时目录，不碰工作区数据
+    workdir = tempfile.mkdtemp(prefix="fund-bench-")
+    os.chdir(workdir)
+
+    results = []
+    try:
+        for n in [int(s) for s in args.sizes.split(",") if s]:
+            df = make_portfolio(n)
+            row = {"size": n}
+            if "refresh" not in skip: row['refresh'] = bench_refresh(upstream, df, args.iterations)
+            if "fetch_core" not in skip: row['fetch_core'] = bench_fetch_core(upstream, df)
+            if "persistence" not in skip: row['persistence'] = bench_persistence(df, args.iterations)
+            results.append(row)
+            print(format_row(row), flush=True)
+    finally:
+        upstream.stop()
+    if args.json:
+        with open(os.path.join(ROOT, args.json) if not os.path.isabs(args.json) else args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+    return results
+
+def format_row(row):
+    lines = [f"== {row['size']} codes =="]
+    if 'refresh' in row:
+        r = row['refresh']
+        lines.append(f"  refresh              p50 {r['p50']:>9.2f}ms  p95 {r['p95']:>9.2f}ms  p99 {r['p99']:>9.2f}ms  cold {r['cold_ms']:>9.2f}ms  req/refresh {r['req_per_refresh']}  scheduled {r['req_scheduled']}")
+    if 'fetch_core' in row:
+        r = row['fetch_core']
+        lines.append(f"  fetch_core           p50 {r['p50']:>9.2f}ms  p95 {r['p95']:>9.2f}ms  p99 {r['p99']:>9.2f}ms  req/call {r['req_per_call']}")
+    for name, r in row.get('persistence', {}).items():
+        lines.append(f"  {name:<20} p50 {r['p50']:>9.2f}ms  p95 {r['p95']:>9.2f}ms  p99 {r['p99']:>9.2f}ms")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import csv
+import hashlib
+import io
+
+import pandas as pd
+
+import http_pool
+import metrics
+import portfolio_store
+from fund_directory import get_directory, lookup_name
+from transaction_journal import get_journal
+
+# ==========================================
+# 批量导入：券商 / 支付宝导出的持仓与交易记录 (CSV / Excel)
+# ==========================================
+CHUNK_ROWS = 5000          # CSV 按块流式解析，每块整列校验
+HEADER_SCAN_LINES = 50     # 导出文件表头前常有若干行说明文字，在前 N 行内找表头
+ENCODINGS = ("utf-8-sig", "gb18030")
+SOURCES = {"alipay": "场外(支付宝)", "broker": "场内(证券)"}
+
+# 各家导出的列名不统一，按别名归一化
+ALIASES = {
+    "code": ("基金代码", "证券代码", "产品代码", "代码", "code"),
+    "name": ("基金名称", "证券名称", "产品名称", "商品名称", "名称", "name"),
+    "shares": ("持有份额", "确认份额", "成交数量", "持仓数量", "股份余额", "证券数量", "份额", "shares"),
+    "cost": ("成本价", "参考成本价", "持仓成本", "买入均价", "成本", "cost"),
+    "amount": ("确认金额", "成交金额", "发生金额", "申请金额", "交易金额", "金额", "amount"),
+    "price": ("确认净值", "成交净值", "成交均价", "成交价格", "价格", "price"),
+    "type": ("交易类型", "业务类型", "业务名称", "买卖标志", "操作", "方向", "type"),
+    "date": ("确认日期", "成交日期", "交易日期", "申请日期", "交易时间", "日期", "date"),
+}
+BUY_WORDS = ("买", "申购", "认购", "定投", "转入", "buy")
+SELL_WORDS = ("卖", "赎回", "转出", "sell")
+
+DELIMITERS = (",", "\t", ";")
+
+def _match_column(header):
+    h = str(header).strip().strip("\"'").strip().lower()
+    for field, names in ALIASES.items():
+        if h in names: return field
+    return None
+
+def _header_fields(row):
+    fields = {_match_column(c) for c in row}
+    return len(fields - {None}) if "code" in fields else 0
+
+def _find_header(rows):
+    """第一行同时含代码列与其他可识别列的即为表头"""
+    for i, row in enumerate(rows):
+        if _header_fields(row) >= 2: return i
+    return None
+
+def _sniff_header(lines):
+    """用 csv.reader 按各候选分隔符解析 (处理引号)，返回 (表头行号, 分隔符)；
+    取能识别出最多列名的分隔符，支付宝那种 “列名\t,” 的制表符填充逗号文件也能判对"""
+    for i, line in enumerate(lines):
+        scores = [(_header_fields(next(csv.reader([line], delimiter=d), [])), d) for d in DELIMITERS]
+        best, delim = max(scores, key=lambda p: p[0])
+        if best >= 2: return i, delim
+    return None, None
+
+def _decode(data):
+    sample = data[:65536]
+    for enc in ENCODINGS:
+        try:
+            sample.decode(enc)
+            return enc
+        except UnicodeDecodeError as e:
+            if e.start > len(sample) - 4: return enc  # 采样截断在多字节字符中间
+    return ENCODINGS[-1]
+
+def read_chunks(data, filename):
+    """bytes -> 逐块产出 DataFrame (列已归一化，值均为字符串，_line 为原文件行号)"""
+    if str(filename).lower().endswith((".xlsx", ".xls")):
+        try: raw = pd.read_excel(io.BytesIO(data), header=None, dtype=str)
+        except ImportError as e: raise ValueError(f"读取 Excel 需要安装 openpyxl: {e}")
+        head = _find_header(raw.head(HEADER_SCAN_LINES).fillna("").values.tolist())
+        if head is None: raise ValueError("未找到表头 (需要包含「基金代码」等列)")
+        body = raw.iloc[head + 1:].set_axis(list(raw.iloc[head]), axis=1)
+        body.insert(0, "_line", body.index + 1)
+        chunks = (body.iloc[i:i + CHUNK_ROWS] for i in range(0, len(body), CHUNK_ROWS))
+    else:
+        text = io.TextIOWrapper(io.BytesIO(data), encoding=_decode(data), errors="replace", newline="")
+        lines = [text.readline() for _ in range(HEADER_SCAN_LINES)]
+        head, sep = _sniff_header([l.rstrip("\r\n") for l in lines])
+        if head is None: raise ValueError("未找到表头 (需要包含「基金代码」等列)")
+        text.seek(0)
+        reader = pd.read_csv(text, sep=sep, skiprows=head, dtype=str, chunksize=CHUNK_ROWS, skipinitialspace=True,
+                             on_bad_lines="skip", engine="python", index_col=False)
+        chunks = (c.assign(_line=c.index + head + 2) for c in reader)
+    for chunk in chunks:
+        chunk = chunk.rename(columns=lambda c: c if c == "_line" else (_match_column(c) or c))
+        chunk = chunk.loc[:, ~chunk.columns.duplicated()]
+        yield chunk.dropna(how="all", subset=[c for c in chunk.columns if c != "_line"])
+
+def _col(df, name):
+    return df[name].fillna("").astype(str).str.strip() if name in df.columns else pd.Series("", index=df.index)
+
+def _number(s):
+    """去掉千分位、货币符号、单位后转数值，无法解析的为 NaN"""
+    return pd.to_numeric(s.str.replace(r"[,¥￥元份股\s]", "", regex=True), errors="coerce")
+
+def _reject(df, mask, reason, out):
+    if mask.any():
+        out.append(pd.DataFrame({"行号": df.loc[mask, '_line'], "代码": _col(df, 'code')[mask], "原因": reason}))
+    return df[~mask]
+
+def resolve_names(codes):
+    """{code: 名称}：先查本地目录，目录里没有的再并发走网络"""
+    d = get_directory()
+    names = {c: d.name(c) for c in dict.fromkeys(codes)}
+    missing = [c for c, n in names.items() if not n]
+    for c, n in zip(missing, http_pool.fan_out(lookup_name, [(c,) for c in missing])):
+        names[c] = "" if isinstance(n, Exception) else (n or "")
+    return names
+
+# ---------- 解析 + 校验 ----------
+def _holdings_chunk(df, channel, rejected):
+    df = df.assign(code=_col(df, 'code').str.extract(r"(\d{6})", expand=False))
+    df = _reject(df, df['code'].isna(), "无效基金代码", rejected)
+    shares, cost = _number(_col(df, 'shares')), _number(_col(df, 'cost'))
+    df = _reject(df, ~(shares > 0), "份额缺失或不为正", rejected)
+    cost = cost[df.index]
+    df = _reject(df, ~(cost >= 0), "成本价缺失", rejected)
+    return pd.DataFrame({"code": df['code'], "name": _col(df, 'name'), "channel": channel,
+                         "cost": cost[df.index], "shares": shares[df.index]})
+
+def _trades_chunk(df, channel, rejected):
+    df = df.assign(code=_col(df, 'code').str.extract(r"(\d{6})", expand=False))
+    df = _reject(df, df['code'].isna(), "无效基金代码", rejected)
+    kind = _col(df, 'type').str.lower()
+    buy, sell = kind.str.contains("|".join(BUY_WORDS)), kind.str.contains("|".join(SELL_WORDS))
+    df = _reject(df, ~(buy ^ sell), "无法识别买卖方向", rejected)
+    date = pd.to_datetime(_col(df, 'date').str.slice(0, 10).str.replace(r"[/.年月]", "-", regex=True), errors="coerce")
+    df = _reject(df, date.isna(), "日期无效", rejected)
+    shares, amount, price = _number(_col(df, 'shares')), _number(_col(df, 'amount')), _number(_col(df, 'price'))
+    # 成交净值：有明确价格用价格，否则由金额 / 份额推出
+    nav = price.where(price > 0, amount / shares.where(shares > 0))
+    df = _reject(df, ~(nav > 0) | ~((shares > 0) | (amount > 0)), "缺少成交净值或份额", rejected)
+    idx = df.index
+    by_share = shares[idx] > 0
+    return pd.DataFrame({"code": df['code'], "name": _col(df, 'name'), "channel": channel,
+                         "type": buy[idx].map({True: "buy", False: "sell"}), "trade_date": date[idx].dt.strftime("%Y-%m-%d"),
+                         "mode": by_share.map({True: "share", False: "amount"}),
+                         "value": shares[idx].where(by_share, amount[idx]), "settle_nav": nav[idx]})
+
+def parse(data, filename, kind="holdings", source="alipay", confirm_days_fn=None):
+    """流式解析并整批校验，返回 {"kind", "rows": 可导入 DataFrame, "rejected": DataFrame[行号, 代码, 原因]}。
+    名称缺失的按代码去重后统一补齐；持仓同代码多行 (多账户) 合并为一行，成本按份额加权"""
+    channel = SOURCES.get(source, source)
+    parse_chunk = _holdings_chunk if kind == "holdings" else _trades_chunk
+    rejected, parts = [], []
+    with metrics.timer("import_seconds", kind=kind):
+        for chunk in read_chunks(data, filename): parts.append(parse_chunk(chunk, channel, rejected))
+        rows = pd.concat(parts, ignore_index=True) if parts else parse_chunk(pd.DataFrame({"_line": []}), channel, [])
+        blank = rows['name'] == ""
+        if blank.any(): rows.loc[blank, 'name'] = rows.loc[blank, 'code'].map(resolve_names(rows.loc[blank, 'code']))
+        if kind == "holdings" and not rows.empty:
+            rows = rows.assign(paid=rows['cost'] * rows['shares']).groupby(['code', 'channel'], as_index=False, sort=False) \
+                       .agg(name=('name', 'first'), shares=('shares', 'sum'), paid=('paid', 'sum'))
+            rows['cost'] = rows['paid'] / rows['shares']
+            fn = confirm_days_fn or (lambda name, code: 1)
+            rows['confirm_days'] = [fn(n, c) for n, c in zip(rows['name'], rows['code'])]
+            rows = rows[portfolio_store.COLUMNS]
+    rejected = pd.concat(rejected, ignore_index=True) if rejected else pd.DataFrame(columns=["行号", "代码", "原因"])
+    metrics.inc("import_rows_total", len(rows), kind=kind, result="accepted")
+    metrics.inc("import_rows_total", len(rejected), kind=kind, result="rejected")
+    return {"kind": kind, "rows": rows, "rejected": rejected}
+
+# ---------- 提交 (各一次写入) ----------
+def commit_holdings(rows, store=None):
+    """同 (代码, 渠道) 的持仓以导入结果覆盖份额与成本，其余追加；整表一次写盘，返回新出现的 (code, channel)"""
+    return (store or portfolio_store.get_store()).upsert(rows)
+
+def _import_keys(rows):
+    """按内容生成去重键 (同一文件里完全相同的交易按出现次序区分)，重复导入同一文件不会重复记账"""
+    cols = ['code', 'trade_date', 'type', 'mode', 'value']
+    base = rows[cols].astype(str).agg("|".join, axis=1)
+    seq = base.groupby(base).cumcount().astype(str)
+    return [hashlib.blake2b(f"{b}|{n}".encode(), digest_size=8).hexdigest() for b, n in zip(base, seq)]
+
+def commit_trades(rows, journal=None, submit_date=None):
+    """历史交易按已结算 (成交净值即导入的净值) 一次追加到交易日志；不改动当前持仓。返回 (新增笔数, 重复跳过笔数)"""
+    journal = journal or get_journal()
+    if rows.empty: return 0, 0
+    rows = rows.assign(import_key=_import_keys(rows))
+    seen = {t.get('import_key') for t in journal.all()}
+    new = rows[~rows['import_key'].isin(seen)]
+    txs = [dict(r, submit_date=submit_date or r['trade_date'], confirm_date=r['trade_date'], status="settled", source="import")
+           for r in new.to_dict('records')]
+    journal.add_many(txs)
+    return len(txs), len(rows) - len(txs)
@@ -0,0 +1,374 @@
+import json
+import time
+import re
+import random
+import threading
+from datetime import datetime
+
+import http_pool
+import metrics
+import nav_store
+from holdings_estimator import HoldingsEstimator
+
+# ==========================================
+# 网络请求层 (云端增强版)
+# ==========================================
+# 替身映射 (QDII场外无估值时，借用场内ETF行情)
+PROXY_MAP = {
+    "019005": "161226",  # 白银C -> 白银LOF
+    "019004": "161226",
+    "017437": "513100",  # 华宝纳指 -> 纳指ETF
+    "006479": "513100",
+    "016702": "513100",  # 银华海外 -> 纳指ETF (暂借)
+}
+
+QUOTE_CHUNK_SIZE = 40   # 单次行情请求的代码数 (每只代码展开为 sh/sz 两个符号)
+QUOTE_MAX_AGE = 3.0     # 批量行情的有效期(秒)，略短于刷新周期
+# 对冲参数：主源超过 *_HEDGE_DELAY 秒未返回即并发请求备源，单次取数最多等待 *_DEADLINE 秒
+QUOTE_HEDGE_DELAY, QUOTE_DEADLINE = 0.3, 2.5      # 腾讯 -> 东财
+FUNDGZ_HEDGE_DELAY, FUNDGZ_DEADLINE = 0.8, 3.0    # 官方估值 -> 重仓股估算 / 替身行情
+HOLDINGS_URL = "https://fundmobapi.eastmoney.com/FundMNewApi/FundMNInverstPosition?FCODE={code}&deviceid=Wap&plat=Wap&product=EFund&version=2.0.0"
+
+def get_headers():
+    """生成随机伪装头，防止云端被拦截"""
+    user_agents = [
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36"
+    ]
+    return {
+        "User-Agent": random.choice(user_agents),
+        "Referer": "http://fund.eastmoney.com/",
+        "Accept": "*/*"
+    }
+
+def fast_get_name(code):
+    """云端部署优化版：获取基金名称"""
+    code = str(code).zfill(6)
+    try:
+        url = f"http://fundgz.1234567.com.cn/js/{code}.js"
+        r = http_pool.get(url, headers=get_headers(), timeout=5)
+        if r.status_code == 200 and "jsonpgz" in r.text:
+            content = re.findall(r'jsonpgz\((.*?)\);', r.text)
+            if content:
+                data = json.loads(content[0])
+                return data.get('name', '')
+    except Exception as e:
+        metrics.inc("fetch_errors_total", source="fundgz_name")
+        print(f"Name fetch error ({code}): {e}")
+
+    try:
+        url = f"https://fund.1234567.com.cn/fundpage/v1/info?productId={code}"
+        r = http_pool.get(url, headers=get_headers(), timeout=3).json()
+        if r.get("data") and r["data"].get("fund_name"):
+            return r["data"]["fund_name"]
+    except:
+        metrics.inc("fetch_errors_total", source="fundpage_name")
+    return ""
+
+def fetch_fund_list():
+    """天天基金全市场基金列表 fundcode_search.js，返回 [(代码, 拼音缩写, 名称, 类型, 全拼)]；失败返回空列表"""
+    try:
+        r = http_pool.get("http://fund.eastmoney.com/js/fundcode_search.js", headers=get_headers(), timeout=10)
+        r.encoding = "utf-8"
+        body = re.search(r'\[.*\]', r.text, re.S)
+        return [tuple(str(x) for x in item[:5]) for item in json.loads(body.group(0)) if len(item) >= 5] if body else []
+    except Exception as e:
+        print(f"Fund list fetch error: {e}")
+        return []
+
+# ------------------------------------------
+# 批量行情引擎: 一个刷新周期内所有场内代码 + 替身代码合并请求
+# ------------------------------------------
+_quote_book = {}  # code -> (时间戳, 涨跌幅, 来源)
+_quote_lock = threading.Lock()
+
+def proxy_target(code):
+    """场外基金的替身行情代码 (PROXY_MAP 或 LOF/ETF 自身)"""
+    target = PROXY_MAP.get(code)
+    if not target and code.startswith(('16', '15', '50', '51')): target = code
+    return target
+
+def collect_quote_codes(pairs):
+    """汇总本轮需要的场内行情代码: 场内持仓本身 + 场外持仓的替身"""
+    codes = []
+    for code, channel in pairs:
+        code = str(code).zfill(6)
+        if "场内" in str(channel): codes.append(code)
+        elif "场外" in str(channel) and proxy_target(code): codes.append(proxy_target(code))
+    return list(dict.fromkeys(codes))
+
+def parse_gtimg_payload(text):
+    """一次性解析 qt.gtimg.cn 多代码报文 (v_sh510300="1~名称~代码~现价~昨收~...";)，返回 {code: 涨跌幅}"""
+    rates = {}
+    for line in text.split(';'):
+        if '="' not in line: continue
+        head, body = line.split('="', 1)
+        sym = head.strip().rsplit('_', 1)[-1]
+        parts = body.split('~')
+        if len(parts) <= 30 or sym[:2] not in ("sh", "sz"): continue
+        try: curr, close = float(parts[3]), float(parts[4])
+        except ValueError: continue
+        # 同一代码 sh/sz 都有报价时，与单只查询一致取先出现的一条
+        if close > 0: rates.setdefault(sym[2:], (curr - close) / close)
+    return rates
+
+def parse_eastmoney_ulist(data):
+    """解析 push2 ulist.np 多代码报文，返回 {code: 涨跌幅}"""
+    rates = {}
+    diff = (data.get('data') or {}).get('diff') or []
+    if isinstance(diff, dict): diff = list(diff.values())
+    for item in diff:
+        try:
+            if item.get('f3') not in (None, "-"): rates.setdefault(str(item['f12']), float(item['f3']) / 100)
+        except (TypeError, ValueError): pass
+    return rates
+
+def _fetch_gtimg_chunk(chunk):
+    symbols = ",".join(s for c in chunk for s in (f"sh{c}", f"sz{c}"))
+    try:
+        r = http_pool.get(f"http://qt.gtimg.cn/q={symbols}", timeout=2)
+        return parse_gtimg_payload(r.text)
+    except:
+        metrics.inc("fetch_errors_total", source="gtimg")
+        return {}
+
+def _fetch_eastmoney_chunk(chunk):
+    secids = ",".join(f"{'1' if c.startswith(('5', '6')) else '0'}.{c}" for c in chunk)
+    try:
+        url = f"http://push2.eastmoney.com/api/qt/ulist.np/get?fields=f3,f12&np=1&secids={secids}"
+        return parse_eastmoney_ulist(http_pool.get(url, headers=get_headers(), timeout=2).json())
+    except:
+        metrics.inc("fetch_errors_total", source="push2")
+        return {}
+
+def _fetch_quote_chunk(chunk):
+    """腾讯为主、东财对冲：腾讯迟迟不回或失败时并发请求东财，取先到的一方"""
+    rates, winner = http_pool.hedge(lambda: _fetch_gtimg_chunk(chunk), lambda: _fetch_eastmoney_chunk(chunk),
+                                    delay=QUOTE_HEDGE_DELAY, deadline=QUOTE_DEADLINE, name="quote")
+    # 腾讯没有胜出时东财必然已经发出过 (失败也算)，src 为 None 表示两边都没有结果
+    return rates or {}, {"primary": "腾讯", "secondary": "东财"}.get(winner)
+
+def fetch_market_rates_batch(codes, chunk_size=QUOTE_CHUNK_SIZE):
+    """批量拉取场内涨跌幅: 按块合并请求(各块并发、各自对冲)，只有腾讯应答的块里缺失的代码再按块走东财；结果写入行情簿"""
+    codes = list(dict.fromkeys(str(c).zfill(6) for c in codes if c))
+    chunks = lambda lst: [(lst[i:i + chunk_size],) for i in range(0, len(lst), chunk_size)]
+    quotes, answered = {}, set()
+    for (chunk,), part in zip(chunks(codes), http_pool.fan_out(_fetch_quote_chunk, chunks(codes))):
+        if isinstance(part, Exception): continue
+        rates, src = part
+        if src != "腾讯": answered.update(chunk)  # 东财已在对冲中请求过，不再重复
+        for c, rate in rates.items(): quotes[c] = (rate, src)
+    missing = [c for c in codes if c not in quotes and c not in answered]
+    metrics.inc("fallback_total", len(missing), path="tencent_to_eastmoney")
+    for part in http_pool.fan_out(_fetch_eastmoney_chunk, chunks(missing)):
+        for c, rate in part.items(): quotes[c] = (rate, "东财")
+    now = time.time()
+    with _quote_lock:
+        for c, (rate, src) in quotes.items(): _quote_book[c] = (now, rate, src)
+    return quotes
+
+def prefetch_market_quotes(pairs):
+    """刷新周期开始前调用：一次性预取本轮所有场内/替身行情"""
+    codes = collect_quote_codes(pairs)
+    return fetch_market_rates_batch(codes) if codes else {}
+
+def fetch_market_rate_only(code):
+    with _quote_lock: hit = _quote_book.get(code)
+    fresh = bool(hit) and time.time() - hit[0] < QUOTE_MAX_AGE
+    metrics.cache_hit("quote_book", fresh)
+    if fresh: return hit[1], hit[2]
+    return fetch_market_rates_batch([code]).get(code, (0.0, "-"))
+
+# ------------------------------------------
+# 重仓股: 季度持仓 + 成分股批量行情 (估算逻辑见 holdings_estimator.py)
+# ------------------------------------------
+def stock_symbol(code, exchange=""):
+    """持仓股票代码 -> 腾讯行情符号 (sh/sz/hk/us)；北交所等暂不支持的返回空串"""
+    code = str(code).strip()
+    if exchange == "116" or (code.isdigit() and len(code) <= 5): return f"hk{code.zfill(5)}"
+    if not code.isdigit(): return f"us{code.upper()}"
+    if code.startswith(("6", "9", "5")): return f"sh{code}"
+    if code.startswith(("0", "2", "3")): return f"sz{code}"
+    return ""
+
+def fetch_fund_holdings(code):
+    """最新一期披露的前十大重仓股，返回 (报告期, [(行情符号, 名称, 占净值比例)])；失败返回 None"""
+    try:
+        data = http_pool.get(HOLDINGS_URL.format(code=code), headers=get_headers(), timeout=5).json()
+        stocks = []
+        for item in (data.get('Datas') or {}).get('fundStocks') or []:
+            sym = stock_symbol(item.get('GPDM', ""), str(item.get('NEWTEXCH', "")))
+            try: weight = float(item.get('JZBL') or 0) / 100
+            except (TypeError, ValueError): continue
+            if sym and weight > 0: stocks.append((sym, item.get('GPJC', ""), weight))
+        return str(data.get('Expansion') or ""), stocks
+    except Exception:
+        metrics.inc("fetch_errors_total", source="holdings")
+        return None
+
+def parse_gtimg_stocks(text):
+    """解析腾讯多市场报文 (v_sh600519 / v_hk00700 / v_usAAPL)，返回 {行情符号: 涨跌幅}"""
+    rates = {}
+    for line in text.split(';'):
+        if '="' not in line: continue
+        head, body = line.split('="', 1)
+        sym = head.strip()[2:] if head.strip().startswith("v_") else head.strip()
+        parts = body.split('~')
+        if len(parts) <= 5: continue
+        try: curr, close = float(parts[3]), float(parts[4])
+        except ValueError: continue
+        if close > 0: rates[sym] = (curr - close) / close
+    return rates
+
+def _fetch_stock_chunk(chunk):
+    try: return parse_gtimg_stocks(http_pool.get(f"http://qt.gtimg.cn/q={','.join(chunk)}", timeout=2).text)
+    except Exception:
+        metrics.inc("fetch_errors_total", source="gtimg_stock")
+        return {}
+
+def fetch_stock_rates(symbols, chunk_size=QUOTE_CHUNK_SIZE * 2):
+    """去重后的成分股按块合并请求、各块并发"""
+    symbols = list(dict.fromkeys(symbols))
+    rates = {}
+    for part in http_pool.fan_out(_fetch_stock_chunk, [(symbols[i:i + chunk_size],) for i in range(0, len(symbols), chunk_size)]):
+        if not isinstance(part, Exception): rates.update(part)
+    return rates
+
+_estimator = None
+_estimator_lock = threading.Lock()
+
+def get_holdings_estimator():
+    global _estimator
+    with _estimator_lock:
+        if _estimator is None: _estimator = HoldingsEstimator(fetch_fund_holdings, fetch_stock_rates)
+        return _estimator
+
+def prefetch_holdings_estimates(pairs):
+    """刷新周期开始前调用：缺官方估值的场外基金一次性按重仓股估算"""
+    return get_holdings_estimator().prefetch([str(c).zfill(6) for c, ch in pairs if "场外" in str(ch)])
+
+def fetch_nav_history(code, start_date=None, end_date=None, page_size=20):
+    """分页拉取 lsjz 历史净值，返回 [(日期, 单位净值)]；请求失败返回 None"""
+    rows, page = [], 1
+    headers = {'Referer': 'http://fundf10.eastmoney.com/', 'User-Agent': 'Mozilla/5.0'}
+    try:
+        while True:
+            url = f"http://api.fund.eastmoney.com/f10/lsjz?fundCode={code}&pageIndex={page}&pageSize={page_size}&startDate={start_date or ''}&endDate={end_date or ''}"
+            data = http_pool.get(url, headers=headers, timeout=3).json()
+            items = (data.get('Data') or {}).get('LSJZList') or []
+            rows += [(item['FSRQ'], float(item['DWJZ'])) for item in items if item.get('DWJZ')]
+            if not items or page * page_size >= int(data.get('TotalCount') or 0): break
+            page += 1
+    except:
+        metrics.inc("fetch_errors_total", source="lsjz")
+        return None
+    return rows
+
+def get_previous_nav(code, today_str):
+    """昨日净值：优先读本地净值库，水位线未到今天时只增量同步缺失的日期"""
+    store = nav_store.get_store()
+    mark, _ = store.watermark(code)
+    metrics.cache_hit("nav_store_prev", bool(mark) and mark >= today_str)
+    if not mark or mark < today_str:
+        # 已知今日净值已公布，同步必有进展，不受节流限制
+        store.sync(code, fetch_nav_history, today_str, force=True)
+    return store.previous_nav(code, today_str)
+
+def _fetch_fundgz(code, today_str):
+    """fundgz 实时估值 / 当日净值，返回要写入结果的字段；失败返回 None"""
+    try:
+        ts = int(time.time() * 1000)
+        url = f"http://fundgz.1234567.com.cn/js/{code}.js?rt={ts}"
+        r = http_pool.get(url, headers=get_headers(), timeout=5)
+        if r.status_code == 200 and "jsonpgz" in r.text:
+            content = re.findall(r'jsonpgz\((.*?)\);', r.text)
+            if not content or not content[0].strip():
+                # 接口正常但报文为空 (jsonpgz();)：该基金没有官方估值，之后的刷新周期纳入重仓股批量估算
+                get_holdings_estimator().mark_missing(code)
+            else:
+                js = json.loads(content[0])
+                dwjz = float(js['dwjz'])
+                jzrq = js['jzrq']
+                if jzrq == today_str:
+                    prev_nav = get_previous_nav(code, today_str)
+                    if prev_nav and prev_nav > 0:
+                        real_rate = (dwjz - prev_nav) / prev_nav
+                        return {"base_nav": prev_nav, "live_price": dwjz, "est_rate": real_rate, "nav_date": jzrq, "source": "净值已更新"}
+                    return {"base_nav": dwjz, "live_price": dwjz, "est_rate": 0.0, "nav_date": jzrq, "source": "已更新(缺基准)"}
+                est = float(js['gszzl']) / 100
+                return {"base_nav": dwjz, "live_price": dwjz * (1+est), "est_rate": est, "nav_date": jzrq, "source": "官方估值"}
+    except Exception as e: metrics.inc("fetch_errors_total", source="fundgz")
+    return None
+
+_base_book = {}  # code -> 行情中心最近一份快照里的基准净值
+_base_lock = threading.Lock()
+
+def remember_base_navs(navs):
+    """行情中心载入磁盘快照 / 每个 tick 结束时写入 {code: 基准净值}"""
+    with _base_lock: _base_book.update(navs)
+
+def known_base_nav(code, today_str):
+    """备用估算可用的基准净值：本地净值库的昨日净值，其次行情中心快照里的；都没有返回 None。
+    已知缺官方估值的基金 (fundgz 不会给出 dwjz) 再按节流增量同步一次净值库"""
+    store = nav_store.get_store()
+    nav = store.previous_nav(code, today_str)
+    if nav: return nav
+    with _base_lock: nav = _base_book.get(code)
+    if nav or not get_holdings_estimator().needs(code): return nav
+    store.sync(code, fetch_nav_history, today_str)
+    return store.previous_nav(code, today_str)
+
+def _fallback_estimate(code, target):
+    """官方估值缺失时的估算 (涨跌幅, 来源)：重仓股估算优先，其次替身行情；都没有返回 None"""
+    est = get_holdings_estimator().lookup(code)
+    if est: return est[0], "持仓估算"
+    if target:
+        m_rate, _ = fetch_market_rate_only(target)
+        if m_rate != 0: return m_rate, f"借用{target}"
+    return None
+
+def fetch_fund_data_core(fund_code, channel):
+    code = str(fund_code).zfill(6)
+    res = {"est_rate": 0.0, "base_nav": 1.0, "live_price": 1.0, "source": "-", "nav_date": ""}
+    today_str = str(datetime.now().date())
+
+    if "场内" in str(channel):
+        rate, src = fetch_market_rate_only(code)
+        if src != "-":
+            res.update({"est_rate": rate, "source": src + "(场内)", "live_price": 1.0 * (1 + rate)})
+            return res
+
+    # 本地净值库已同步到今天：直接用库里的今日/昨日净值，重启后也无需再请求
+    store = nav_store.get_store()
+    if store.watermark(code)[0] == today_str:
+        nav, prev_nav = store.nav_on(code, today_str), store.previous_nav(code, today_str)
+        if nav and prev_nav:
+            metrics.cache_hit("nav_store_final", True)
+            res.update({"base_nav": prev_nav, "live_price": nav, "est_rate": (nav - prev_nav) / prev_nav, "nav_date": today_str, "source": "净值已更新"})
+            return res
+
+    target = proxy_target(code) if "场外" in str(channel) else None
+    fallback = (lambda: _fallback_estimate(code, target)) if "场外" in str(channel) else None
+    # fundgz 与备用估算对冲：估值接口迟迟不回时并发估算，整行最多等待 FUNDGZ_DEADLINE 秒。
+    # 备用估算只给出涨跌幅，没有可信的基准净值时不参与对冲 (否则会按 1.0 定价)，只等 fundgz
+    base = known_base_nav(code, today_str) if fallback else None
+    start = time.monotonic()
+    got, winner = http_pool.hedge(lambda: _fetch_fundgz(code, today_str), fallback if base else None,
+                                  delay=FUNDGZ_HEDGE_DELAY, deadline=FUNDGZ_DEADLINE, name="fundgz")
+    if winner == "primary":
+        res.update(got)
+        if fallback and res['source'] == "官方估值" and abs(res['est_rate']) < 0.0001:
+            # 无官方估值 (如 QDII)：记下来，之后的刷新周期会把它纳入重仓股批量估算
+            get_holdings_estimator().mark_missing(code)
+            # 备用估算仍受同一个截止时间约束，整行最多等待 FUNDGZ_DEADLINE 秒
+            got, _ = http_pool.hedge(fallback, deadline=max(0.0, FUNDGZ_DEADLINE - (time.monotonic() - start)), name="fundgz_fallback")
+            winner = "secondary"
+    if winner == "secondary" and got:
+        m_rate, label = got
+        if res['source'] == "-": res['base_nav'] = base
+        metrics.inc("fallback_total", path="estimate_to_holdings" if label == "持仓估算" else "estimate_to_proxy")
+        res.update({"est_rate": m_rate, "source": label, "live_price": res['base_nav'] * (1 + m_rate)})
+
+    if res['live_price'] == 1.0 and res['base_nav'] != 1.0:
+        res['live_price'] = res['base_nav'] * (1 + res['est_rate'])
+    return res
@@ -0,0 +1,146 @@
+import bisect
+import gzip
+import json
+import os
+import threading
+import time
+
+import fund_api
+
+# ==========================================
+# 离线基金目录：代码 / 拼音 / 名称 前缀索引
+# ==========================================
+DIRECTORY_FILE = "fund_directory.json.gz"
+REFRESH_AFTER = 7 * 86400  # 目录文件超过 7 天后台重新拉取一次 (补充新发基金)
+
+class FundDirectory:
+    """全市场基金列表按列压缩存盘，内存中为各字段建立排序索引，前缀查找为 O(log n)。"""
+
+    def __init__(self, path=DIRECTORY_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._loading = False
+        self.updated_at = 0.0
+        self._build([])
+        if os.path.exists(path):
+            try: self._load_file()
+            except (OSError, ValueError) as e: print(f"Directory load error: {e}")
+        if time.time() - self.updated_at > REFRESH_AFTER: self.refresh_async()
+
+    def _build(self, rows):
+        """rows: [(代码, 拼音缩写, 名称, 类型, 全拼)]"""
+        rows = sorted({r[0]: r for r in rows}.values())
+        codes = [r[0] for r in rows]
+        index = {
+            "abbr": sorted((r[1].upper(), i) for i, r in enumerate(rows)),
+            "pinyin": sorted((r[4].upper(), i) for i, r in enumerate(rows)),
+            "name": sorted((r[2], i) for i, r in enumerate(rows)),
+        }
+        self._data = (rows, codes, index)  # 整体替换，读者无需加锁
+
+    def _load_file(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as f: data = json.load(f)
+        self._build(list(zip(data['codes'], data['abbr'], data['names'], data['types'], data['pinyin'])))
+        self.updated_at = data.get('updated', 0.0)
+
+    def _save_file(self):
+        rows = self._data[0]
+        cols = list(zip(*rows)) if rows else [[]] * 5
+        data = dict(zip(["codes", "abbr", "names", "types", "pinyin"], map(list, cols)), updated=self.updated_at)
+        tmp = f"{self.path}.tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f: json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, self.path)
+
+    def refresh(self):
+        rows = fund_api.fetch_fund_list()
+        if not rows: return False
+        self.updated_at = time.time()
+        self._build(rows)
+        self._save_file()
+        return True
+
+    def refresh_async(self):
+        with self._lock:
+            if self._loading: return
+            self._loading = True
+        def _run():
+            try: self.refresh()
+            except Exception as e: print(f"Directory refresh error: {e}")
+            finally: self._loading = False
+        threading.Thread(target=_run, name="fund-directory", daemon=True).start()
+
+    # ---------- 查询 ----------
+    def __len__(self): return len(self._data[1])
+
+    def get(self, code):
+        """精确代码 -> {code, name, type}，不存在返回 None"""
+        code = str(code).strip().zfill(6)
+        rows, codes, _ = self._data
+        i = bisect.bisect_left(codes, code)
+        if i < len(codes) and codes[i] == code:
+            r = rows[i]
+            return {"code": r[0], "name": r[2], "type": r[3]}
+        return None
+
+    def name(self, code):
+        hit = self.get(code)
+        return hit['name'] if hit else ""
+
+    def fund_type(self, code):
+        hit = self.get(code)
+        return hit['type'] if hit else ""
+
+    def _prefix(self, keys, prefix, limit):
+        i = bisect.bisect_left(keys, (prefix,))
+        out = []
+        while i < len(keys) and len(out) < limit and keys[i][0].startswith(prefix):
+            out.append(keys[i][1]); i += 1
+        return out
+
+    def search(self, query, limit=10):
+        """代码前缀 / 拼音缩写或全拼前缀 / 名称前缀；前缀结果不足时再按名称包含补齐"""
+        q = str(query).strip()
+        if not q: return []
+        rows, codes, index = self._data
+        if q.isdigit():
+            i = bisect.bisect_left(codes, q)
+            hits = []
+            while i < len(codes) and len(hits) < limit and codes[i].startswith(q):
+                hits.append(i); i += 1
+        elif q.isascii():
+            hits = self._prefix(index['abbr'], q.upper(), limit)
+            hits += [i for i in self._prefix(index['pinyin'], q.upper(), limit) if i not in hits]
+        else:
+            hits = self._prefix(index['name'], q, limit)
+            if len(hits) < limit:
+                hits += [i for i, r in enumerate(rows) if q in r[2] and i not in hits][:limit - len(hits)]
+        return [{"code": rows[i][0], "name": rows[i][2], "type": rows[i][3]} for i in hits[:limit]]
+
+    def add(self, code, name, fund_type=""):
+        """网络查到的目录外基金补入内存索引"""
+        code = str(code).zfill(6)
+        if name and not self.get(code):
+            self._build(self._data[0] + [(code, "", name, fund_type, "")])
+
+_directory = None
+_directory_lock = threading.Lock()
+
+def get_directory():
+    global _directory
+    with _directory_lock:
+        if _directory is None: _directory = FundDirectory()
+        return _directory
+
+_misses = {}          # code -> 上次网络也查不到的时间，避免每次重绘都重新请求
+MISS_TTL = 60
+
+def lookup_name(code):
+    """先查本地目录 (微秒级)，目录中没有的才走网络"""
+    code = str(code).strip().zfill(6)
+    d = get_directory()
+    name = d.name(code)
+    if name or time.time() - _misses.get(code, 0) < MISS_TTL: return name
+    name = fund_api.fast_get_name(code)
+    if name: d.add(code, name)
+    else: _misses[code] = time.time()
+    return name
@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+import http_pool
+import metrics
+
+# ==========================================
+# 重仓股估值：季度前十大持仓 × 成分股实时涨跌
+# ==========================================
+HOLDINGS_FILE = "fund_holdings.json"
+DISCLOSURE_LAG_DAYS = 25   # 季末后约 15 个工作日披露前十大持仓
+RETRY_AFTER = 86400        # 新一期持仓尚未取到时，一天后再试
+EQUITY_RATIO = 0.9         # 前十大之外的股票仓位按同样涨跌外推，整体股票仓位按九成计
+MIN_COVERAGE = 0.5         # 有行情的权重不足已披露权重的一半时不给出估算
+ESTIMATE_MAX_AGE = 3.0     # 批量估算结果的有效期(秒)，与批量行情一致
+MISSING_TTL = 86400        # 标记为“无官方估值”的基金多久后重新确认
+
+def expected_report(today=None):
+    """按披露节奏，今天应当能拿到的最新一期报告期 (季末日期)"""
+    d = (today or date.today()) - timedelta(days=DISCLOSURE_LAG_DAYS)
+    q_month = (d.month - 1) // 3 * 3  # 上一个季末所在月 (0 表示去年 12 月)
+    if q_month == 0: return str(date(d.year - 1, 12, 31))
+    return str(date(d.year, q_month + 1, 1) - timedelta(days=1))
+
+class HoldingsEstimator:
+    """持仓按季度缓存在本地；每个 tick 把所有需要估算的基金的成分股去重后批量取行情，
+    用 (基金 × 股票) 稀疏权重与股票涨跌幅相乘一次算出全部估值。
+    fetch_holdings(code) -> (报告期, [(行情符号, 名称, 权重)]) 或 None；fetch_quotes(symbols) -> {symbol: 涨跌幅}"""
+
+    def __init__(self, fetch_holdings, fetch_quotes, path=HOLDINGS_FILE):
+        self.fetch_holdings, self.fetch_quotes, self.path = fetch_holdings, fetch_quotes, path
+        self._lock = threading.Lock()
+        self._cache = {}     # code -> {"date", "checked", "stocks": [[symbol, name, weight]]}
+        self._missing = {}   # code -> 标记时间 (官方估值缺失，需要持仓估算)
+        self._book = {}      # code -> (时间戳, 估算涨跌幅, 覆盖权重)
+        self._matrix = None  # (基金元组, 持仓版本) -> 稀疏结构
+        self._version = 0
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f: self._cache = json.load(f)
+            except (OSError, ValueError) as e: print(f"Holdings cache error: {e}")
+
+    # ---------- 持仓 ----------
+    def _stale(self, code, now):
+        entry = self._cache.get(code)
+        if entry is None: return True
+        return entry['date'] < expected_report() and now - entry.get('checked', 0) > RETRY_AFTER
+
+    def ensure(self, codes):
+        """并发补齐缺失或过期的持仓，整批写盘一次"""
+        now = time.time()
+        with self._lock: stale = [c for c in dict.fromkeys(codes) if self._stale(c, now)]
+        if not stale: return 0
+        results = http_pool.fan_out(self.fetch_holdings, [(c,) for c in stale])
+        with self._lock:
+            for code, got in zip(stale, results):
+                old = self._cache.get(code, {"date": "", "stocks": []})
+                if isinstance(got, Exception) or got is None:
+                    self._cache[code] = dict(old, checked=now); continue
+                report, stocks = got
+                self._cache[code] = {"date": report or old['date'], "checked": now, "stocks": [list(s) for s in stocks] or old['stocks']}
+            self._version += 1
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f: json.dump(self._cache, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        return len(stale)
+
+    def holdings(self, code):
+        with self._lock: return self._cache.get(code)
+
+    # ---------- 需要估算的基金 ----------
+    def mark_missing(self, code):
+        with self._lock: self._missing[code] = time.time()
+
+    def needs(self, code):
+        with self._lock: return time.time() - self._missing.get(code, 0) < MISSING_TTL
+
+    # ---------- 估算 ----------
+    def _structure(self, codes):
+        """稀疏权重 (COO)：行=基金，列=去重后的股票；持仓不变时复用"""
+        key = (tuple(codes), self._version)
+        if self._matrix and self._matrix[0] == key: return self._matrix[1]
+        symbols, col, rows, cols, weights = [], {}, [], [], []
+        for i, code in enumerate(codes):
+            for sym, _, w in (self._cache.get(code) or {}).get('stocks', []):
+                if sym not in col: col[sym] = len(symbols); symbols.append(sym)
+                rows.append(i); cols.append(col[sym]); weights.append(float(w))
+        disclosed = np.bincount(np.asarray(rows, dtype=np.intp), weights=np.asarray(weights), minlength=len(codes))
+        structure = (symbols, np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp), np.asarray(weights), disclosed)
+        self._matrix = (key, structure)
+        metrics.inc("holdings_symbols_total", len(rows), kind="per_fund")
+        metrics.inc("holdings_symbols_total", len(symbols), kind="unique")
+        return structure
+
+    def estimate(self, codes):
+        """{code: (估算涨跌幅, 有行情的权重)}；持仓或行情不足的基金不在结果中"""
+        codes = list(dict.fromkeys(codes))
+        if not codes: return {}
+        self.ensure(codes)
+        with self._lock: symbols, rows, cols, weights, disclosed = self._structure(codes)
+        if not symbols: return {}
+        quotes = self.fetch_quotes(symbols)
+        ret = np.array([quotes.get(s, np.nan) for s in symbols])[cols]
+        ok = ~np.isnan(ret)
+        # 稀疏乘法：按基金行累加 权重×涨跌幅 与 有行情的权重
+        num = np.bincount(rows[ok], weights=weights[ok] * ret[ok], minlength=len(codes))
+        covered = np.bincount(rows[ok], weights=weights[ok], minlength=len(codes))
+        valid = (covered > 0) & (covered >= MIN_COVERAGE * disclosed)
+        est = np.where(valid, num / np.where(covered > 0, covered, 1.0) * EQUITY_RATIO, 0.0)
+        now = time.time()
+        out = {codes[i]: (float(est[i]), float(covered[i])) for i in np.flatnonzero(valid)}
+        with self._lock:
+            for code, (rate, cov) in out.items(): self._book[code] = (now, rate, cov)
+        return out
+
+    def prefetch(self, codes):
+        """刷新周期开始前调用：为所有缺官方估值的基金一次性估算"""
+        return self.estimate([c for c in codes if self.needs(c)])
+
+    def lookup(self, code):
+        """本轮批量估算的结果 (估算涨跌幅, 覆盖权重)；只对已标记缺官方估值的基金生效，
+        批量结果缺失或过期时返回 None，不单独取持仓和行情 (下一轮 prefetch 会补上)"""
+        if not self.needs(code): return None
+        with self._lock: hit = self._book.get(code)
+        fresh = bool(hit) and time.time() - hit[0] < ESTIMATE_MAX_AGE
+        metrics.cache_hit("holdings_estimate", fresh)
+        return (hit[1], hit[2]) if fresh else None
@@ -0,0 +1,161 @@
+import asyncio
+import threading
+import time
+from urllib.parse import urlsplit
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# ==========================================
+# 共享 HTTP 层：按主机复用连接池 + 限制并发
+# ==========================================
+# 各主机的最大并发请求数 (同时也是该主机连接池的大小)，未列出的主机使用默认值
+HOST_LIMITS = {
+    "fundgz.1234567.com.cn": 32,
+    "api.fund.eastmoney.com": 16,
+    "qt.gtimg.cn": 8,
+    "push2.eastmoney.com": 8,
+}
+DEFAULT_HOST_LIMIT = 8
+FANOUT_WORKERS = 64  # 一次扇出最多同时在途的调用数，真正的上限由各主机并发数决定
+HEDGE_WORKERS = 128  # 对冲请求共用线程池
+
+# 熔断：连续失败 BREAKER_THRESHOLD 次后该主机熔断 BREAKER_COOLDOWN 秒，期间请求直接失败；
+# 冷却结束放行一个探测请求 (半开)，成功即恢复，失败则重新熔断
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+
+_sessions = {}    # host -> requests.Session (keep-alive)
+_semaphores = {}  # host -> BoundedSemaphore
+_breakers = {}    # host -> [连续失败次数, 熔断至(epoch), 是否有探测在途]
+_lock = threading.Lock()
+_hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """主机处于熔断期，请求未发出"""
+
+def set_host_limit(host, limit):
+    """调整某主机的并发上限；已建立的连接池随之重建"""
+    with _lock:
+        HOST_LIMITS[host] = int(limit)
+        _semaphores.pop(host, None)
+        old = _sessions.pop(host, None)
+    if old: old.close()
+
+def _host_slot(host):
+    with _lock:
+        if host not in _sessions:
+            limit = HOST_LIMITS.get(host, DEFAULT_HOST_LIMIT)
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=limit)
+            s.mount("http://", adapter); s.mount("https://", adapter)
+            _sessions[host] = s
+            _semaphores[host] = threading.BoundedSemaphore(limit)
+        return _sessions[host], _semaphores[host]
+
+# ---------- 熔断器 ----------
+def _breaker_allow(host):
+    now = time.time()
+    with _lock:
+        b = _breakers.get(host)
+        if b is None or b[1] == 0: return True
+        if now < b[1] or b[2]: return False
+        b[2] = True  # 半开：只放行一个探测
+        return True
+
+def _breaker_record(host, ok):
+    with _lock:
+        b = _breakers.setdefault(host, [0, 0.0, False])
+        b[2] = False
+        if ok: b[0], b[1] = 0, 0.0; return
+        b[0] += 1
+        if b[0] >= BREAKER_THRESHOLD:
+            if not b[1]: metrics.inc("circuit_open_total", host=host)
+            b[1] = time.time() + BREAKER_COOLDOWN
+
+def breaker_states():
+    """{host: (状态 closed/open/half-open, 连续失败次数)}"""
+    now = time.time()
+    with _lock: items = [(h, list(b)) for h, b in _breakers.items()]
+    return {h: ("closed" if not until else "open" if now < until and not probing else "half-open", fails)
+            for h, (fails, until, probing) in items}
+
+def get(url, **kwargs):
+    """替代 requests.get：同主机复用长连接，超过并发上限时排队等待；熔断中的主机直接抛 CircuitOpenError"""
+    host = urlsplit(url).hostname or ""
+    if not _breaker_allow(host):
+        metrics.inc("http_requests_total", host=host, outcome="rejected")
+        raise CircuitOpenError(f"circuit open for {host}")
+    session, sem = _host_slot(host)
+    with sem:
+        t, outcome, healthy = time.perf_counter(), "error", False
+        try:
+            r = session.get(url, **kwargs)
+            outcome = "ok" if r.status_code < 400 else "error"
+            healthy = r.status_code < 500  # 4xx 是请求本身的问题，不计入主机故障
+            return r
+        except requests.exceptions.Timeout:
+            outcome = "timeout"; raise
+        finally:
+            _breaker_record(host, healthy)
+            metrics.inc("http_requests_total", host=host, outcome=outcome)
+            metrics.observe("http_request_seconds", time.perf_counter() - t, host=host)
+
+def fan_out(fn, items):
+    """并发执行 fn(*item) 并按输入顺序返回结果 (异常原样作为结果返回)。
+    asyncio 负责调度，阻塞请求在线程中执行，整批耗时约等于一次往返而不是按固定线程数分批。"""
+    items = [tuple(it) for it in items]
+    if not items: return []
+    workers = min(len(items), FANOUT_WORKERS)
+
+    async def _main(pool):
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(*(loop.run_in_executor(pool, fn, *it) for it in items), return_exceptions=True)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fan-out") as pool:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(_main(pool))
+        # 已处于事件循环中 (无法嵌套 asyncio.run)，退化为线程池直接扇出
+        futures = [pool.submit(fn, *it) for it in items]
+        out = []
+        for f in futures:
+            try: out.append(f.result())
+            except Exception as e: out.append(e)
+        return out
+
+def hedge(primary, secondary=None, delay=0.3, deadline=3.0, accept=bool, name="hedge"):
+    """对冲请求：先发 primary，delay 秒内没有可用结果 (或已失败) 就并发发出 secondary，取先到的可用结果。
+    整体最多等待 deadline 秒，返回 (结果, "primary"/"secondary")，都不可用时返回 (None, None)。
+    超时未返回的调用在后台自行结束 (各自受 HTTP 超时约束)，结果丢弃。"""
+    def ok(f):
+        try: return accept(f.result())
+        except Exception: return False
+
+    start = time.monotonic()
+    calls = {_hedge_pool.submit(primary): "primary"}
+    wait(calls, timeout=delay)
+    if secondary is not None and not any(f.done() and ok(f) for f in calls):
+        calls[_hedge_pool.submit(secondary)] = "secondary"
+    pending = set(calls)
+    while pending:
+        done, pending = wait(pending, timeout=max(0.0, deadline - (time.monotonic() - start)), return_when=FIRST_COMPLETED)
+        if not done: break
+        # 同时完成时优先 primary
+        for f in sorted(done, key=lambda f: calls[f] != "primary"):
+            if ok(f):
+                metrics.inc("hedge_total", path=name, winner=calls[f])
+                return f.result(), calls[f]
+    metrics.inc("hedge_total", path=name, winner="none")
+    return None, None
+
+def run_within(fns, deadline):
+    """并发执行若干无参调用，最多等待 deadline 秒；返回按输入顺序的结果，未完成或失败的为 None。
+    超时的调用在后台自行结束 (各自受 HTTP 超时约束)，结果丢弃。"""
+    futures = [_hedge_pool.submit(fn) for fn in fns]
+    wait(futures, timeout=deadline)
+    return [f.result() if f.done() and not f.exception() else None for f in futures]
@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import market_calendar as cal
+
+# ==========================================
+# 日内走势记录：预分配 NumPy 环形缓冲，每只基金内存固定
+# ==========================================
+INTRADAY_DIR = "intraday"
+RESOLUTION = 4          # 秒；同一时间桶内的多次 tick 只保留最后一次
+SLOTS = 4096            # 环形缓冲槽数 (4 秒一槽可覆盖约 4.5 小时，够一个 A股交易日)
+
+class IntradayRecorder:
+    """所有序列共用一条时间轴：_ts[槽] 为时间戳，_rates[基金行, 槽] 为该 tick 的 est_rate (float32)，
+    _value/_pnl 为组合总市值与今日盈亏。每只基金固定占 SLOTS*4 字节，写满后覆盖最早的槽。
+    A股收盘后 (或跨日时) 把当日数据落盘为 INTRADAY_DIR/日期.npz，重启后可从当日文件恢复。"""
+
+    def __init__(self, directory=INTRADAY_DIR, slots=SLOTS, resolution=RESOLUTION):
+        self.directory, self.slots, self.resolution = directory, slots, resolution
+        self._lock = threading.Lock()
+        self._rows = {}  # code -> _rates 行号
+        self._rates = np.full((16, slots), np.nan, dtype=np.float32)
+        self._reset(None)
+        self._restore(str(cal.now_in("CN").date()))
+
+    def _reset(self, day):
+        self.day, self._head, self._bucket, self._flushed = day, -1, None, False
+        self._ts = np.full(self.slots, np.nan)
+        self._value = np.full(self.slots, np.nan)
+        self._pnl = np.full(self.slots, np.nan)
+        self._rates.fill(np.nan)
+        self.version = getattr(self, "version", 0) + 1
+
+    def _row(self, code):
+        row = self._rows.get(code)
+        if row is None:
+            row = self._rows[code] = len(self._rows)
+            if row >= len(self._rates):  # 新基金超出容量时按倍数扩容
+                grown = np.full((len(self._rates) * 2, self.slots), np.nan, dtype=np.float32)
+                grown[:len(self._rates)] = self._rates
+                self._rates = grown
+        return row
+
+    # ---------- 写入 (行情中心每个 tick 调用) ----------
+    def record(self, rates, value, pnl, now=None):
+        """rates: {code: est_rate}；value/pnl: 组合总市值与今日盈亏"""
+        now = time.time() if now is None else now
+        day = str(cal.now_in("CN", now).date())
+        with self._lock:
+            if day != self.day:
+                if self.day and not self._flushed: self._flush_locked()
+                self._reset(day)
+            bucket = int(now // self.resolution)
+            if bucket != self._bucket:
+                self._head, self._bucket = self._head + 1, bucket
+                self._rates[:, self._head % self.slots] = np.nan
+            slot = self._head % self.slots
+            self._ts[slot], self._value[slot], self._pnl[slot] = now, value, pnl
+            if rates:
+                rows = np.fromiter((self._row(c) for c in rates), dtype=np.intp, count=len(rates))
+                self._rates[rows, slot] = np.fromiter(rates.values(), dtype=np.float32, count=len(rates))
+            self.version += 1
+            due = not self._flushed and cal.after_close("CN", now)
+        if due: self.flush()
+
+    # ---------- 读取 ----------
+    def _ordered(self):
+        """按时间顺序的槽号 (调用方持锁)"""
+        if self._head < 0: return np.empty(0, dtype=np.intp)
+        n = min(self._head + 1, self.slots)
+        return (np.arange(self._head - n + 1, self._head + 1) % self.slots).astype(np.intp)
+
+    def _downsample(self, ts, points):
+        """按等宽时间桶取每桶最后一个点，返回保留的下标"""
+        if len(ts) <= points: return np.arange(len(ts))
+        edges = np.linspace(ts[0], ts[-1], points + 1)[1:]
+        idx = np.searchsorted(ts, edges, side="right") - 1
+        return np.unique(idx)
+
+    def portfolio_series(self, points=240):
+        """组合日内走势 DataFrame[总市值, 今日盈亏]，索引为本地时间"""
+        with self._lock:
+            order = self._ordered()
+            ts, value, pnl = self._ts[order], self._value[order], self._pnl[order]
+        keep = self._downsample(ts, points)
+        return pd.DataFrame({"总市值": value[keep], "今日盈亏": pnl[keep]}, index=_to_index(ts[keep]))
+
+    def fund_series(self, codes, points=240):
+        """若干基金的日内 est_rate 走势 (百分比)，每只基金一列"""
+        with self._lock:
+            order = self._ordered()
+            ts = self._ts[order]
+            cols = {c: self._rates[self._rows[c], order] for c in codes if c in self._rows}
+        keep = self._downsample(ts, points)
+        return pd.DataFrame({c: v[keep] * 100 for c, v in cols.items()}, index=_to_index(ts[keep]))
+
+    # ---------- 落盘 ----------
+    def _path(self, day): return os.path.join(self.directory, f"{day}.npz")
+
+    def _flush_locked(self):
+        order = self._ordered()
+        if not len(order): return
+        codes = list(self._rows)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self._path(self.day) + ".tmp.npz"
+        np.savez_compressed(tmp, ts=self._ts[order], value=self._value[order], pnl=self._pnl[order],
+                            codes=np.array(codes, dtype="U6"), rates=self._rates[:len(codes)][:, order])
+        os.replace(tmp, self._path(self.day))
+        self._flushed = True
+
+    def flush(self):
+        with self._lock: self._flush_locked()
+
+    def _restore(self, day):
+        path = self._path(day)
+        if not os.path.exists(path): return
+        try:
+            with np.load(path) as f:
+                ts, value, pnl, codes, rates = f['ts'][-self.slots:], f['value'][-self.slots:], f['pnl'][-self.slots:], list(f['codes']), f['rates'][:, -self.slots:]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Intraday restore error: {e}"); return
+        self.day, n = day, len(ts)
+        self._ts[:n], self._value[:n], self._pnl[:n] = ts, value, pnl
+        for i, c in enumerate(codes):
+            row = self._row(str(c))
+            self._rates[row, :n] = rates[i]
+        self._head, self._bucket = n - 1, int(ts[-1] // self.resolution) if n else None
+
+def _to_index(ts):
+    return pd.to_datetime(ts, unit="s", utc=True).tz_convert("Asia/Shanghai").tz_localize(None)
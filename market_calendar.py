@@ -0,0 +1,86 @@
+import json
+import os
+from datetime import date, datetime, time as dtime, timedelta, timezone
+
+try:
+    from zoneinfo import ZoneInfo
+    _TZ = {"CN": ZoneInfo("Asia/Shanghai"), "HK": ZoneInfo("Asia/Hong_Kong"), "US": ZoneInfo("America/New_York")}
+except Exception:  # 系统缺少时区库时退回固定时差 (美股不处理夏令时)
+    _TZ = {"CN": timezone(timedelta(hours=8)), "HK": timezone(timedelta(hours=8)), "US": timezone(timedelta(hours=-5))}
+
+# ==========================================
+# 交易日历：A股 / 港股 / 美股 交易时段与休市日
+# ==========================================
+SESSIONS = {
+    "CN": ((dtime(9, 30), dtime(11, 30)), (dtime(13, 0), dtime(15, 0))),
+    "HK": ((dtime(9, 30), dtime(12, 0)), (dtime(13, 0), dtime(16, 0))),
+    "US": ((dtime(9, 30), dtime(16, 0)),),
+}
+
+def _span(start, end):
+    d0, d1 = date.fromisoformat(start), date.fromisoformat(end)
+    return {str(d0 + timedelta(days=i)) for i in range((d1 - d0).days + 1)}
+
+# 沪深交易所休市安排 (周末另计)；每年公布后补充，或写入 HOLIDAY_FILE 覆盖
+HOLIDAYS = {
+    "CN": set().union(
+        _span("2025-01-01", "2025-01-01"), _span("2025-01-28", "2025-02-04"), _span("2025-04-04", "2025-04-04"),
+        _span("2025-05-01", "2025-05-05"), _span("2025-06-02", "2025-06-02"), _span("2025-10-01", "2025-10-08"),
+        _span("2026-01-01", "2026-01-02"), _span("2026-02-16", "2026-02-23"), _span("2026-04-06", "2026-04-06"),
+        _span("2026-05-01", "2026-05-05"), _span("2026-06-19", "2026-06-19"), _span("2026-09-25", "2026-09-25"),
+        _span("2026-10-01", "2026-10-07"),
+    ),
+    "HK": set(),
+    "US": set(),
+}
+# 可选的本地休市日补充文件：{"CN": ["2027-01-01", ...], "HK": [...], "US": [...]}
+HOLIDAY_FILE = "holidays.json"
+
+def _load_holiday_file(path=HOLIDAY_FILE):
+    if not os.path.exists(path): return
+    try:
+        with open(path, "r", encoding="utf-8") as f: extra = json.load(f)
+        for market, days in extra.items(): HOLIDAYS.setdefault(market, set()).update(map(str, days))
+    except (OSError, ValueError) as e: print(f"Holiday file error: {e}")
+
+_load_holiday_file()
+
+def now_in(market, now=None):
+    """now: epoch 秒或 aware datetime，返回该市场当地时间"""
+    if now is None: now = datetime.now(timezone.utc)
+    elif not isinstance(now, datetime): now = datetime.fromtimestamp(now, timezone.utc)
+    return now.astimezone(_TZ[market])
+
+def is_trading_day(market, d):
+    return d.weekday() < 5 and str(d) not in HOLIDAYS.get(market, ())
+
+def in_session(market, now=None):
+    local = now_in(market, now)
+    if not is_trading_day(market, local.date()): return False
+    t = local.time()
+    return any(a <= t < b for a, b in SESSIONS[market])
+
+def next_open(market, now=None):
+    """下一个开盘时刻 (当前处于交易时段则返回当前时刻)，返回 aware datetime"""
+    local = now_in(market, now)
+    d = local.date()
+    for _ in range(30):
+        if is_trading_day(market, d):
+            for a, b in SESSIONS[market]:
+                start = datetime.combine(d, a, local.tzinfo)
+                end = datetime.combine(d, b, local.tzinfo)
+                if local < end: return max(start, local)
+        d += timedelta(days=1)
+    return local + timedelta(days=1)
+
+def after_close(market, now=None):
+    """今天是交易日且已收盘"""
+    local = now_in(market, now)
+    return is_trading_day(market, local.date()) and local.time() >= SESSIONS[market][-1][1]
+
+def fund_market(name):
+    """按基金名称粗分底层市场：美股 / 港股 / A股"""
+    n = str(name or "").upper()
+    if any(k in n for k in ("纳斯达克", "纳指", "标普", "美国", "道琼斯", "NASDAQ", "S&P")): return "US"
+    if any(k in n for k in ("恒生", "港股", "香港", "H股", "中概")): return "HK"
+    return "CN"
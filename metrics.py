@@ -0,0 +1,116 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# ==========================================
+# 进程内指标：计数器 + 延迟直方图 (Prometheus 文本格式导出)
+# ==========================================
+PREFIX = "fund_"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0)  # 秒
+
+HELP = {
+    "http_requests_total": "上游 HTTP 请求数 (按主机、结果: ok/timeout/error/rejected)",
+    "http_request_seconds": "上游 HTTP 请求耗时",
+    "fetch_errors_total": "解析或请求失败后被吞掉的异常数 (按数据源)",
+    "fallback_total": "降级路径使用次数 (tencent_to_eastmoney / estimate_to_holdings / estimate_to_proxy)",
+    "holdings_symbols_total": "重仓股估算的成分股数量 (per_fund 为逐只合计，unique 为去重后实际请求)",
+    "hedge_total": "对冲请求的胜出方 (primary/secondary/none)",
+    "circuit_open_total": "主机熔断次数",
+    "cache_requests_total": "缓存命中/未命中次数",
+    "coalesced_total": "并发未命中合并到同一在途请求的次数",
+    "refresh_cycle_seconds": "行情中心一个 tick 的耗时",
+    "calculate_dashboard_seconds": "calculate_dashboard_data 估值耗时",
+    "analytics_seconds": "业绩回放引擎耗时 (build / update)",
+    "settlement_seconds": "批量结算耗时 (手动 / 自动)",
+    "settled_total": "已结算交易笔数",
+    "alerts_seconds": "提醒规则每个 tick 的判断耗时",
+    "alerts_total": "提醒条数 (fired / suppressed 为冷却或限流拦下)",
+    "import_seconds": "批量导入解析耗时 (持仓 / 交易记录)",
+    "import_rows_total": "批量导入行数 (accepted / rejected)",
+}
+
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> 数值
+_hists = {}     # (name, labels) -> [各桶计数..., +Inf 计数, 总和]
+
+def _key(name, labels): return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name, n=1, **labels):
+    k = _key(name, labels)
+    with _lock: _counters[k] = _counters.get(k, 0) + n
+
+def observe(name, seconds, **labels):
+    k = _key(name, labels)
+    with _lock:
+        h = _hists.get(k)
+        if h is None: h = _hists[k] = [0] * (len(BUCKETS) + 1) + [0.0]
+        h[bisect_left(BUCKETS, seconds)] += 1
+        h[-1] += seconds
+
+@contextmanager
+def timer(name, **labels):
+    t = time.perf_counter()
+    try: yield
+    finally: observe(name, time.perf_counter() - t, **labels)
+
+def cache_hit(cache, hit, n=1):
+    if n: inc("cache_requests_total", n, cache=cache, result="hit" if hit else "miss")
+
+def reset():
+    with _lock: _counters.clear(); _hists.clear()
+
+# ---------- 读取 ----------
+def counters(name):
+    """{labels(dict 转 tuple): 数值}"""
+    with _lock: return {k[1]: v for k, v in _counters.items() if k[0] == name}
+
+def _quantile(buckets, count, q):
+    """按桶上界估算分位数 (与 Prometheus histogram_quantile 同样的粗粒度)"""
+    if not count: return 0.0
+    rank, seen = q * count, 0
+    for i, c in enumerate(buckets):
+        seen += c
+        if seen >= rank: return BUCKETS[i] if i < len(BUCKETS) else float("inf")
+    return float("inf")
+
+def histograms(name):
+    """[{labels, count, sum, avg, p50, p95}]"""
+    with _lock: items = [(k[1], list(h)) for k, h in _hists.items() if k[0] == name]
+    out = []
+    for labels, h in items:
+        buckets, total = h[:-1], h[-1]
+        count = sum(buckets)
+        out.append({"labels": dict(labels), "count": count, "sum": total, "avg": total / count if count else 0.0,
+                    "p50": _quantile(buckets, count, 0.5), "p95": _quantile(buckets, count, 0.95)})
+    return out
+
+def _fmt_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs: return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+def prometheus_text():
+    """Prometheus exposition 文本"""
+    with _lock:
+        counters_ = sorted(_counters.items())
+        hists_ = sorted((k, list(h)) for k, h in _hists.items())
+    lines, declared = [], set()
+    def declare(name, kind):
+        if name in declared: return
+        declared.add(name)
+        lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+    for (name, labels), v in counters_:
+        declare(name, "counter")
+        lines.append(f"{PREFIX}{name}{_fmt_labels(labels)} {v}")
+    for (name, labels), h in hists_:
+        declare(name, "histogram")
+        acc = 0
+        for i, c in enumerate(h[:-1]):
+            acc += c
+            le = f"{BUCKETS[i]}" if i < len(BUCKETS) else "+Inf"
+            lines.append(f"{PREFIX}{name}_bucket{_fmt_labels(labels, [('le', le)])} {acc}")
+        lines.append(f"{PREFIX}{name}_sum{_fmt_labels(labels)} {h[-1]:.6f}")
+        lines.append(f"{PREFIX}{name}_count{_fmt_labels(labels)} {acc}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,107 @@
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+
+# ==========================================
+# 本地净值历史库 (SQLite，按 代码+日期 存储)
+# ==========================================
+NAV_DB_FILE = "nav_history.db"
+SYNC_MIN_INTERVAL = 300   # 同一只基金两次增量同步的最小间隔(秒)，避免未出净值时反复请求
+DEFAULT_LOOKBACK_DAYS = 30
+
+class NavStore:
+    """每只基金维护一个水位线 (已完整同步到的日期)，同步时只拉取水位线之后缺失的日期。"""
+
+    def __init__(self, path=NAV_DB_FILE):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS nav (code TEXT, date TEXT, nav REAL, PRIMARY KEY (code, date)) WITHOUT ROWID")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS nav_sync (code TEXT PRIMARY KEY, watermark TEXT, synced_at REAL)")
+
+    def upsert(self, code, rows):
+        """rows: [(日期, 单位净值)]"""
+        rows = [(code, str(d), float(v)) for d, v in rows if v]
+        if not rows: return 0
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO nav (code, date, nav) VALUES (?, ?, ?)", rows)
+        return len(rows)
+
+    def nav_on(self, code, day):
+        with self._lock:
+            row = self._conn.execute("SELECT nav FROM nav WHERE code=? AND date=?", (code, str(day))).fetchone()
+        return row[0] if row else None
+
+    def previous_nav(self, code, day):
+        """严格早于 day 的最近一个净值"""
+        with self._lock:
+            row = self._conn.execute("SELECT nav FROM nav WHERE code=? AND date<? ORDER BY date DESC LIMIT 1", (code, str(day))).fetchone()
+        return row[0] if row else None
+
+    def latest_nav(self, code):
+        with self._lock:
+            row = self._conn.execute("SELECT nav FROM nav WHERE code=? ORDER BY date DESC LIMIT 1", (code,)).fetchone()
+        return row[0] if row else None
+
+    def history(self, code, start=None, end=None):
+        q, args = "SELECT date, nav FROM nav WHERE code=?", [code]
+        if start: q += " AND date>=?"; args.append(str(start))
+        if end: q += " AND date<=?"; args.append(str(end))
+        with self._lock: return self._conn.execute(q + " ORDER BY date", args).fetchall()
+
+    def history_many(self, codes, start=None, end=None):
+        """一次查询多只基金的历史净值，返回 {code: [(日期, 净值)]} (按日期升序)"""
+        codes = list(codes)
+        if not codes: return {}
+        q = f"SELECT code, date, nav FROM nav WHERE code IN ({','.join('?' * len(codes))})"
+        args = list(codes)
+        if start: q += " AND date>=?"; args.append(str(start))
+        if end: q += " AND date<=?"; args.append(str(end))
+        out = {c: [] for c in codes}
+        with self._lock: rows = self._conn.execute(q + " ORDER BY code, date", args).fetchall()
+        for code, d, v in rows: out[code].append((d, v))
+        return out
+
+    def earliest(self, code):
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(date) FROM nav WHERE code=?", (code,)).fetchone()
+        return row[0] if row else None
+
+    def backfill(self, code, fetch_fn, start):
+        """补齐 start 之前缺失的历史 (水位线之前的区间 sync 不会回头拉取)"""
+        first = self.earliest(code)
+        if first and first <= str(start): return 0
+        end = str(date.fromisoformat(first) - timedelta(days=1)) if first else None
+        rows = fetch_fn(code, str(start), end or "")
+        return self.upsert(code, rows) if rows else 0
+
+    def watermark(self, code):
+        with self._lock:
+            row = self._conn.execute("SELECT watermark, synced_at FROM nav_sync WHERE code=?", (code,)).fetchone()
+        return row if row else (None, 0.0)
+
+    def sync(self, code, fetch_fn, today_str, start=None, force=False):
+        """增量同步：只拉取 (水位线, 今天] 之间缺失的日期；fetch_fn(code, start_date, end_date) -> [(日期, 净值)]"""
+        mark, synced_at = self.watermark(code)
+        if mark and mark >= today_str: return 0
+        if not force and time.time() - synced_at < SYNC_MIN_INTERVAL: return 0
+        if mark: begin = str(date.fromisoformat(mark) + timedelta(days=1))
+        else: begin = str(start or date.fromisoformat(today_str) - timedelta(days=DEFAULT_LOOKBACK_DAYS))
+        rows = fetch_fn(code, begin, today_str)
+        if rows is None: return 0  # 请求失败，不推进水位线
+        n = self.upsert(code, rows)
+        new_mark = max([str(d) for d, _ in rows] + [mark or ""]) or None
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO nav_sync (code, watermark, synced_at) VALUES (?, ?, ?)", (code, new_mark, time.time()))
+        return n
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None: _store = NavStore()
+        return _store
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+
+import metrics
+
+# ==========================================
+# 持仓存储：变更感知缓存 + 原子写入
+# ==========================================
+PORTFOLIO_FILE = "portfolio.json"
+COLUMNS = ['code', 'name', 'channel', 'cost', 'shares', 'confirm_days']
+
+def normalize_portfolio(data):
+    """records -> 规范化的持仓 DataFrame (代码补零、渠道缺省、数值列转型)"""
+    df = pd.DataFrame(data) if len(data) else pd.DataFrame(columns=COLUMNS)
+    for c in COLUMNS:
+        if c not in df.columns: df[c] = ""
+    df['code'] = df['code'].astype(str).str.strip().str.zfill(6)
+    df['channel'] = df['channel'].replace([None, "nan", ""], "场外(支付宝)").astype(str)
+    df['shares'] = pd.to_numeric(df['shares'], errors='coerce').fillna(0.0)
+    df['cost'] = pd.to_numeric(df['cost'], errors='coerce').fillna(0.0)
+    df['confirm_days'] = pd.to_numeric(df['confirm_days'], errors='coerce').fillna(1).astype(int)
+    return df
+
+def to_records(df):
+    """DataFrame -> 可写盘的 records (按列整体转换，不逐行 iterrows)"""
+    out = pd.DataFrame({
+        "code": df['code'].astype(str).str.zfill(6),
+        "name": df['name'].astype(str),
+        "channel": df['channel'].astype(str),
+        "cost": df['cost'].astype(float),
+        "shares": df['shares'].astype(float),
+        "confirm_days": df['confirm_days'].astype(int),
+    })
+    return out.to_dict('records')
+
+class PortfolioStore:
+    """解析后的持仓常驻内存；只有文件 mtime/大小 变化且内容哈希也变化时才重新解析。
+    load() 返回的是共享对象，调用方如需修改请先 copy()。"""
+
+    def __init__(self, path=PORTFOLIO_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self._sig, self._digest, self._df = None, None, None
+        self.version = 0  # 每次内容真正变化时 +1
+
+    def _stat_sig(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size, st.st_ino)
+        except FileNotFoundError: return None
+
+    def load(self):
+        with self._lock:
+            sig = self._stat_sig()
+            hit = self._df is not None and sig == self._sig
+            metrics.cache_hit("portfolio", hit)
+            if hit: return self._df
+            raw = b""
+            if sig is not None:
+                with open(self.path, "rb") as f: raw = f.read()
+            digest = hashlib.blake2b(raw, digest_size=16).digest()
+            if self._df is None or digest != self._digest:
+                try: data = json.loads(raw) if raw else []
+                except ValueError: data = []
+                self._df, self._digest = normalize_portfolio(data), digest
+                self.version += 1
+            self._sig = sig
+            return self._df
+
+    def save(self, df):
+        """先写临时文件再 rename，读者永远看不到写了一半的文件；写完直接更新缓存免去重新解析"""
+        records = to_records(df)
+        raw = json.dumps(records, ensure_ascii=False, indent=4).encode("utf-8")
+        with self._lock:
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(raw)
+                f.flush(); os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self._df, self._digest, self._sig = normalize_portfolio(records), hashlib.blake2b(raw, digest_size=16).digest(), self._stat_sig()
+            self.version += 1
+
+    def patch(self, edited=None, added=None, deleted=None, base_version=None):
+        """按行增量修改：edited {行号: {列: 值}}、added [{列: 值}]、deleted [行号]，行号相对于 base_version 时 load() 的结果。
+        持仓在此期间已被别处改写时返回 None；否则最多写盘一次，返回新出现的 (code, channel) 集合 (需要拉取行情的)"""
+        with self._lock:
+            df = self.load()
+            if base_version is not None and base_version != self.version: return None
+            out = df.copy()
+            for pos, changes in (edited or {}).items():
+                for col, val in changes.items():
+                    if col in COLUMNS: out.at[out.index[int(pos)], col] = val
+            if deleted: out = out.drop(index=out.index[[int(p) for p in deleted]])
+            if added: out = pd.concat([out, pd.DataFrame([{c: r.get(c) for c in COLUMNS} for r in added])], ignore_index=True)
+            # 代码为空的行 (新增未填完 / 被清空) 不写入
+            code = out['code'].astype(str).str.strip()
+            out = normalize_portfolio(out[out['code'].notna() & (code != "") & (code != "nan")].to_dict('records'))
+            if out[COLUMNS].equals(df[COLUMNS]): return set()
+            old_pairs = set(zip(df['code'], df['channel']))
+            self.save(out)
+            return set(zip(out['code'], out['channel'])) - old_pairs
+
+    def upsert(self, rows):
+        """按 (code, channel) 合并一批持仓：已有的覆盖份额与成本 (保留原名称和确认天数)，没有的追加。
+        整表一次写盘，返回新出现的 (code, channel) 集合"""
+        with self._lock:
+            df = self.load()
+            rows = normalize_portfolio(rows.to_dict('records'))
+            keys = list(zip(rows['code'], rows['channel']))
+            prev = {k: (n, d) for k, n, d in zip(zip(df['code'], df['channel']), df['name'], df['confirm_days'])}
+            rows['name'] = [prev[k][0] if k in prev and prev[k][0] else n for k, n in zip(keys, rows['name'])]
+            rows['confirm_days'] = [prev[k][1] if k in prev else d for k, d in zip(keys, rows['confirm_days'])]
+            incoming = set(keys)
+            keep = df[[k not in incoming for k in zip(df['code'], df['channel'])]]
+            self.save(pd.concat([keep, rows], ignore_index=True))
+            return incoming - set(prev)
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None: _store = PortfolioStore()
+        return _store
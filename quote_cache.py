@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import fund_api
+import metrics
+from quote_hub import fund_market_of
+from refresh_scheduler import RefreshScheduler
+
+# ==========================================
+# 分层行情缓存：按数据源类型定有效期 + LRU + 同键请求合并
+# ==========================================
+CACHE_SIZE = 4096   # 最多缓存的 (代码, 渠道) 数，超出按最久未用淘汰
+
+class QuoteCache:
+    """fetch_fund_data_core 结果的进程级缓存。有效期与行情中心同源 (RefreshScheduler)：
+    场内行情盘中几秒、官方估值约一分钟、“净值已更新”保留到下一个交易日开盘、失败结果指数退避。
+    同一 (代码, 渠道) 的并发未命中只发一次请求，其余调用方等待同一个 Future。
+    行情中心每个 tick 的结果通过 absorb() 直接灌入，页面上的零散查询大多不用再发请求。"""
+
+    def __init__(self, fetch_fn=None, maxsize=CACHE_SIZE, scheduler=None):
+        self.fetch_fn = fetch_fn or fund_api.fetch_fund_data_core
+        self.maxsize = maxsize
+        self.scheduler = scheduler or RefreshScheduler(market_of=fund_market_of)
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # (code, channel) -> (过期时间, 数据)，按最近使用排序
+        self._inflight = {}         # (code, channel) -> Future
+
+    @staticmethod
+    def _key(code, channel): return str(code).zfill(6), str(channel)
+
+    def _put_locked(self, key, data, expires):
+        self._data[key] = (expires, data)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            old, _ = self._data.popitem(last=False)
+            self.scheduler.forget([old])
+
+    def absorb(self, data, due=None):
+        """行情中心 tick 监听：整批写入，过期时间沿用行情中心的调度结果"""
+        due = due or {}
+        with self._lock:
+            for key, d in data.items(): self._put_locked(key, d, due.get(key) or self.scheduler.next_due(key, d))
+
+    def peek(self, code, channel):
+        """只读缓存 (过期的也返回)，不发请求；没有返回 None"""
+        with self._lock: hit = self._data.get(self._key(code, channel))
+        return hit[1] if hit else None
+
+    def get(self, code, channel):
+        key = self._key(code, channel)
+        with self._lock:
+            hit = self._data.get(key)
+            if hit and hit[0] > time.time():
+                self._data.move_to_end(key)
+                metrics.cache_hit("quote_cache", True)
+                return hit[1]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader: flight = self._inflight[key] = Future()
+        metrics.cache_hit("quote_cache", False)
+        if not leader:
+            metrics.inc("coalesced_total", cache="quote_cache")
+            return flight.result()
+        try:
+            data = self.fetch_fn(*key)
+            with self._lock: self._put_locked(key, data, self.scheduler.next_due(key, data))
+            flight.set_result(data)
+            return data
+        except Exception as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._lock: self._inflight.pop(key, None)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None: _cache = QuoteCache()
+        return _cache
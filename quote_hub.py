@@ -0,0 +1,185 @@
+import json
+import os
+import time
+import threading
+
+import fund_api
+import http_pool
+import market_calendar
+import metrics
+from fund_directory import get_directory
+from refresh_scheduler import RefreshScheduler
+
+# ==========================================
+# 进程级共享行情中心
+# ==========================================
+SNAPSHOT_FILE = "quote_snapshot.json"
+SNAPSHOT_SAVE_INTERVAL = 15.0  # 快照落盘的最小间隔(秒)
+PREFETCH_DEADLINE = 3.0        # 每个 tick 批量预取 (场内行情 + 重仓股估算) 的总等待上限(秒)
+
+class QuoteHub:
+    """全服务器共用一个后台轮询线程：汇总所有活跃会话关注的 (代码, 渠道)，每个 tick 每只只拉取一次。
+    会话只读共享快照；超过 idle_timeout 未续订的会话自动退订，无人订阅时线程退出。
+    每只基金何时再拉取由 RefreshScheduler 按数据源和交易时段决定，休市/已出净值的基金不占用请求。
+    最近一次快照会落盘；重启后先用它立即出图 (标记为过期)，后台第一轮刷新再逐只替换为新数据。"""
+
+    def __init__(self, fetch_fn=None, interval=4.0, idle_timeout=30.0, scheduler=None, snapshot_path=SNAPSHOT_FILE):
+        self.fetch_fn = fetch_fn or fund_api.fetch_fund_data_core
+        self.interval, self.idle_timeout = interval, idle_timeout
+        self.scheduler = scheduler or RefreshScheduler(market_of=fund_market_of)
+        self.version, self.updated_at = 0, 0.0
+        self._subs = {}        # session_id -> (最后活跃时间, {(code, channel)})
+        self._snapshot = {}    # (code, channel) -> 行情数据
+        self._due = {}         # (code, channel) -> 下次需要拉取的 epoch 秒
+        self._listeners = []   # fn(data, changed)，每个 tick 结束后在轮询线程中调用
+        self._stale = set()    # 来自磁盘快照、本进程尚未重新拉取过的 (code, channel)
+        self._dirty = set()    # 被 invalidate 的 (code, channel)，下一个 tick 无视调度立即重拉
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.snapshot_path, self._saved_at = snapshot_path, 0.0
+        if snapshot_path: self._load_snapshot()
+
+    # ---------- 会话侧 ----------
+    def subscribe(self, session_id, pairs):
+        pairs = {(str(c).zfill(6), str(ch)) for c, ch in pairs}
+        with self._lock:
+            self._subs[session_id] = (time.time(), pairs)
+            # 只有从未拉取过的代码才需要立即唤醒；拉取失败在退避中的等调度到期
+            fresh = any(p not in self._snapshot and p not in self._due for p in pairs)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="quote-hub", daemon=True)
+                self._thread.start()
+        if fresh: self._wake.set()
+
+    def invalidate(self, pairs):
+        """只让指定的 (code, channel) 在下一个 tick 重拉 (如持仓编辑后)，并立即唤醒轮询线程"""
+        pairs = {(str(c).zfill(6), str(ch)) for c, ch in pairs}
+        if not pairs: return
+        with self._lock: self._dirty |= pairs
+        self._wake.set()
+
+    def add_listener(self, fn):
+        """订阅 tick 结果 (日内记录、提醒等)；回调应尽快返回，异常会被吞掉"""
+        with self._lock:
+            if fn not in self._listeners: self._listeners.append(fn)
+
+    def snapshot(self):
+        """返回 (版本号, 更新时间, {(code, channel): 数据})；版本号仅在数据变化时递增"""
+        with self._lock: return self.version, self.updated_at, dict(self._snapshot)
+
+    def stale_pairs(self, pairs=None):
+        """仍在使用磁盘快照旧数据的 (code, channel)"""
+        with self._lock: return set(self._stale) if pairs is None else self._stale.intersection(pairs)
+
+    def watched_pairs(self):
+        """清理闲置订阅后，返回所有活跃会话关注代码的并集"""
+        now = time.time()
+        with self._lock:
+            for sid in [s for s, (seen, _) in self._subs.items() if now - seen > self.idle_timeout]:
+                del self._subs[sid]
+            return set().union(*(p for _, p in self._subs.values())) if self._subs else set()
+
+    # ---------- 轮询侧 ----------
+    def refresh(self, pairs, force=False):
+        """执行一个 tick：未到期的沿用上一份快照，到期的先批量预取场内行情与重仓股估算，再一次性扇出拉取。
+        force=True 忽略调度全部重拉 (基准测试 / 手动刷新)"""
+        now = time.time()
+        pairs = set(pairs)
+        self._due = {p: t for p, t in self._due.items() if p in pairs}
+        self.scheduler.forget([p for p in self._snapshot if p not in pairs])
+        with self._lock: dirty, self._dirty = self._dirty, set()
+        # 未到期的 (包括从未成功、正在退避的) 本轮都不拉取，有上一份快照的沿用
+        waiting = set() if force else {p for p in pairs if p not in dirty and self._due.get(p, 0) > now}
+        data = {p: self._snapshot[p] for p in waiting if p in self._snapshot}
+        todo = [p for p in pairs if p not in waiting]
+        metrics.cache_hit("hub_schedule", True, len(waiting)); metrics.cache_hit("hub_schedule", False, len(todo))
+        # 两个预取阶段并发执行、共用一个截止时间；超时未完成的行情由逐行拉取自行兜底
+        http_pool.run_within([lambda: fund_api.prefetch_market_quotes(todo), lambda: fund_api.prefetch_holdings_estimates(todo)], PREFETCH_DEADLINE)
+        for (code, ch), d in zip(todo, http_pool.fan_out(self.fetch_fn, todo)):
+            # source 为 "-" 是取数全部失败后的占位结果 (净值按 1.0)，与异常一样保留上一份数据并退避重试
+            if isinstance(d, Exception) or d.get('source') == "-":
+                if isinstance(d, Exception): print(f"Quote hub fetch failed ({code}): {d}")
+                d = self._snapshot.get((code, ch))
+                self._due[(code, ch)] = self.scheduler.next_due((code, ch), None, now)
+                if d is None: continue
+            else:
+                self._due[(code, ch)] = self.scheduler.next_due((code, ch), d, now)
+                self._stale.discard((code, ch))
+            data[(code, ch)] = d
+        with self._lock:
+            # 只有内容真正变化才推进版本号，会话据此跳过重绘
+            changed = data != self._snapshot
+            if changed: self.version += 1
+            self._snapshot = data
+            self.updated_at = time.time()
+            listeners = list(self._listeners)
+        fund_api.remember_base_navs(base_navs(data))
+        for fn in listeners:
+            try: fn(data, changed)
+            except Exception as e: print(f"Quote hub listener failed: {e}")
+        if changed and time.time() - self._saved_at >= SNAPSHOT_SAVE_INTERVAL: self.save_snapshot()
+        return data
+
+    # ---------- 快照落盘 ----------
+    def save_snapshot(self):
+        if not self.snapshot_path: return
+        with self._lock:
+            body = {"updated_at": self.updated_at, "quotes": [[c, ch, d] for (c, ch), d in self._snapshot.items()]}
+        tmp = f"{self.snapshot_path}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f: json.dump(body, f, ensure_ascii=False)
+            os.replace(tmp, self.snapshot_path)
+            self._saved_at = time.time()
+        except OSError as e: print(f"Quote snapshot save error: {e}")
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f: body = json.load(f)
+            data = {(c, ch): d for c, ch, d in body.get('quotes', [])}
+        except FileNotFoundError: return
+        except (OSError, ValueError, TypeError) as e:
+            print(f"Quote snapshot load error: {e}"); return
+        if not data: return
+        self._snapshot, self._stale = data, set(data)
+        fund_api.remember_base_navs(base_navs(data))
+        self.version, self.updated_at = 1, float(body.get('updated_at') or 0.0)
+
+    def due_times(self):
+        """{(code, channel): 下次拉取时间}，供 tick 监听者 (如行情缓存) 与调度保持一致"""
+        return dict(self._due)
+
+    def next_wake(self):
+        """距最近一只基金到期的秒数 (无记录时为 0)"""
+        return max(0.0, min(self._due.values(), default=time.time()) - time.time())
+
+    def _run(self):
+        while True:
+            pairs = self.watched_pairs()
+            if not pairs:
+                with self._lock:
+                    # 双检：退出前确认期间没有新订阅
+                    if not self._subs:
+                        self._thread = None
+                        return
+                self._wake.wait(self.interval); self._wake.clear()
+                continue
+            self._wake.clear()
+            try:
+                with metrics.timer("refresh_cycle_seconds"): self.refresh(pairs)
+            except Exception as e: print(f"Quote hub tick failed: {e}")
+            # 休市时睡到最早到期的基金为止；新订阅会通过 _wake 立即唤醒
+            self._wake.wait(max(self.interval, self.next_wake()))
+
+    def shutdown(self):
+        with self._lock: self._subs.clear()
+        self._wake.set()
+        self.save_snapshot()
+
+def base_navs(data):
+    """快照里场外基金的基准净值 {code: 净值}，fundgz 迟迟不回时备用估算据此定价"""
+    return {c: d['base_nav'] for (c, ch), d in data.items() if "场外" in ch and d.get('source') != "-" and d.get('base_nav')}
+
+def fund_market_of(code):
+    """基金底层市场 (CN/HK/US)，按名称关键词判断"""
+    return market_calendar.fund_market(get_directory().name(code))
@@ -0,0 +1,59 @@
+import time
+
+import market_calendar as cal
+
+# ==========================================
+# 自适应刷新调度：按数据源类型 + 交易时段给每只基金单独定下次刷新时间
+# ==========================================
+QUOTE_INTERVAL = 4         # 场内/借用行情：盘中每几秒
+ESTIMATE_INTERVAL = 60     # 官方估值 gszzl：上游约每分钟更新一次
+NAV_WAIT_INTERVAL = 600    # 收盘后等待当日净值公布
+RETRY_INTERVAL = 30        # 取数失败：从 30 秒起指数退避
+RETRY_MAX = 600
+QUIET_MAX = 3600           # 休市期间最长睡眠 (到点再看一次，防止日历有误时永远不刷新)
+
+def source_kind(data):
+    src = str((data or {}).get('source', "-"))
+    if src.endswith("(场内)") or src.startswith("借用"): return "quote"
+    if src in ("官方估值", "持仓估算"): return "estimate"
+    if src == "净值已更新": return "final"
+    if "已更新" in src: return "partial"  # 净值已出但缺昨日基准，等净值库补齐
+    return "unknown"
+
+class RefreshScheduler:
+    """next_due() 返回某只基金下一次需要拉取的 epoch 秒；未到期的基金本轮直接沿用上一份快照。"""
+
+    def __init__(self, market_of=None):
+        self.market_of = market_of or (lambda code: "CN")  # code -> 底层市场 (CN/HK/US)
+        self._failures = {}
+
+    def _until_open(self, now, *markets):
+        opens = [cal.next_open(m, now).timestamp() for m in markets]
+        return min(min(opens), now + QUIET_MAX)
+
+    def next_due(self, pair, data, now=None):
+        now = time.time() if now is None else now
+        code, _ = pair
+        kind = source_kind(data)
+        if kind == "unknown":
+            n = self._failures[pair] = self._failures.get(pair, 0) + 1
+            return now + min(RETRY_INTERVAL * 2 ** (n - 1), RETRY_MAX)
+        self._failures.pop(pair, None)
+
+        if kind == "quote":
+            # 场内 ETF/LOF 及借用的替身都在沪深交易所交易
+            return now + QUOTE_INTERVAL if cal.in_session("CN", now) else self._until_open(now, "CN")
+        if kind == "final":
+            # 今日净值已定稿，下一个交易日开盘前都不会再变
+            local = cal.now_in("CN", now)
+            tomorrow = local.replace(hour=0, minute=0, second=0, microsecond=0).timestamp() + 86400
+            return max(cal.next_open("CN", tomorrow).timestamp(), now + QUOTE_INTERVAL)
+        if kind == "partial": return now + NAV_WAIT_INTERVAL
+        # 官方估值 / 重仓股估算：A股或基金底层市场开盘期间按上游节奏刷新；A股收盘后低频等待净值公布
+        markets = {"CN", self.market_of(code)}
+        if any(cal.in_session(m, now) for m in markets): return now + ESTIMATE_INTERVAL
+        if cal.after_close("CN", now) and cal.now_in("CN", now).hour < 23: return now + NAV_WAIT_INTERVAL
+        return self._until_open(now, *markets)
+
+    def forget(self, pairs):
+        for p in pairs: self._failures.pop(p, None)
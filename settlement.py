@@ -0,0 +1,211 @@
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+import fund_api
+import http_pool
+import market_calendar as cal
+import metrics
+import nav_store
+import portfolio_store
+from transaction_journal import get_journal
+
+# ==========================================
+# 批量结算：到期交易 -> 成交日官方净值 -> 一次写入持仓 + 审计日志
+# ==========================================
+AUDIT_FILE = "settlements.jsonl"
+AUTO_INTERVAL = 300   # 自动结算两次尝试的最小间隔(秒)
+
+def trade_effect(tx, nav):
+    """按成交净值换算 (成交份额, 成交金额)"""
+    value = float(tx['value'])
+    return (value / nav, value) if tx.get('mode') == "amount" else (value, value * nav)
+
+def settle_day(trade_date):
+    """委托实际成交的日期：成交日当天或之后的第一个 A 股交易日"""
+    d = date.fromisoformat(str(trade_date)[:10])
+    for _ in range(30):
+        if cal.is_trading_day("CN", d): break
+        d += timedelta(days=1)
+    return str(d)
+
+def _position_key(tx, keys):
+    """交易对应的持仓行 (code, channel)：按交易的渠道匹配；旧交易没有渠道时取该代码的第一行"""
+    code, channel = tx['code'], tx.get('channel')
+    if channel: return code, str(channel)
+    return next((k for k in keys if k[0] == code), (code, "场外(支付宝)"))
+
+def apply_trades(pdf, trades):
+    """把 [(交易, 成交净值)] 依成交日顺序作用到持仓上：买入按金额加权摊薄成本，卖出只减份额 (不低于 0)。
+    持仓按 (代码, 渠道) 区分，只改写被交易的行。
+    返回 (新持仓 DataFrame, 按执行顺序的每笔 {tx, key, nav, shares, amount, before, after})；原 DataFrame 不被修改。"""
+    keys = list(zip(pdf['code'], pdf['channel'].astype(str)))
+    state = {k: [float(s), float(c)] for k, s, c in zip(keys, pdf['shares'], pdf['cost'])}
+    new_rows, changes = [], []
+    for tx, nav in sorted(trades, key=lambda p: (p[0].get('trade_date', ""), p[0].get('submit_date', ""))):
+        key = _position_key(tx, keys)
+        if key not in state:
+            state[key] = [0.0, 0.0]
+            keys.append(key)
+            new_rows.append({"code": key[0], "name": tx.get('name', ""), "channel": key[1], "cost": 0.0, "shares": 0.0, "confirm_days": 1})
+        shares, cost = state[key]
+        fs, fa = trade_effect(tx, nav)
+        if tx['type'] == "buy":
+            ns = shares + fs
+            state[key] = [ns, (shares * cost + fa) / ns if ns > 0 else 0.0]
+        else:
+            state[key] = [max(shares - fs, 0.0), cost]
+        changes.append({"tx": tx, "key": key, "nav": nav, "shares": fs, "amount": fa, "before": [shares, cost], "after": list(state[key])})
+    out = pd.concat([pdf, pd.DataFrame(new_rows)], ignore_index=True) if new_rows else pdf.copy()
+    traded = {c['key'] for c in changes}
+    rows = [i for i, k in enumerate(zip(out['code'], out['channel'].astype(str))) if k in traded]
+    row_keys = [(out['code'].iat[i], str(out['channel'].iat[i])) for i in rows]
+    out.loc[out.index[rows], 'shares'] = [state[k][0] for k in row_keys]
+    out.loc[out.index[rows], 'cost'] = [state[k][1] for k in row_keys]
+    return out, changes
+
+class SettlementEngine:
+    """到期交易的成交日净值一次性从本地净值库批量查询 (缺的先并发增量同步)，所有份额/成本变更合并为一次持仓写入，
+    交易状态合并为一次日志追加。每批结算先写 prepare 记录、全部落盘后再写 commit，中途崩溃时下次启动据此补完或作废。"""
+
+    def __init__(self, journal=None, portfolio=None, store=None, audit_path=AUDIT_FILE, fetch_fn=None):
+        self.journal = journal or get_journal()
+        self.portfolio = portfolio or portfolio_store.get_store()
+        self.store = store or nav_store.get_store()
+        self.audit_path = audit_path
+        self.fetch_fn = fetch_fn or fund_api.fetch_nav_history
+        self._lock = threading.Lock()
+        self._last_auto = 0.0
+        self._recover()
+
+    # ---------- 净值 ----------
+    def resolve_navs(self, txs, today_str=None, force=True):
+        """{(code, trade_date): 成交净值}；本地库未覆盖成交日的基金先并发补齐，再一次查询全部。
+        force=False 时增量同步受净值库节流限制 (页面展示用)"""
+        if not txs: return {}
+        today_str = today_str or str(datetime.now().date())
+        span = {}
+        for t in txs:
+            lo, hi = span.get(t['code'], (t['trade_date'], t['trade_date']))
+            span[t['code']] = (min(lo, t['trade_date']), max(hi, t['trade_date']))
+
+        def ensure(code):
+            lo, hi = span[code]
+            first = self.store.earliest(code)
+            if force and first and first > lo: self.store.backfill(code, self.fetch_fn, lo)
+            if (self.store.watermark(code)[0] or "") < hi: self.store.sync(code, self.fetch_fn, today_str, start=lo, force=force)
+
+        http_pool.fan_out(ensure, [(c,) for c in span])
+        # 非交易日提交的委托按下一个交易日的净值成交：取不早于成交日的第一个净值。
+        # 只有本地库覆盖到成交日 (或取到的正是下一个交易日) 时才可信，否则可能取到更晚某天的净值
+        history = self.store.history_many(span, min(lo for lo, _ in span.values()))
+        first = {c: self.store.earliest(c) for c in span}
+        out = {}
+        for t in txs:
+            rows = history.get(t['code'], [])
+            i = bisect.bisect_left(rows, (t['trade_date'],))
+            if i == len(rows): continue
+            if (first[t['code']] or "9") <= t['trade_date'] or rows[i][0] == settle_day(t['trade_date']):
+                out[(t['code'], t['trade_date'])] = rows[i][1]
+        return out
+
+    def preview(self, day=None, tx_ids=None, overrides=None, force=True):
+        """返回 (可结算 [(交易, 净值)], 暂不能结算 [(交易, 原因)])；overrides 为手动指定的 {tx_id: 成交净值}"""
+        day = str(day or datetime.now().date())
+        overrides = overrides or {}
+        due = self.journal.due(day)
+        if tx_ids is not None:
+            wanted = set(tx_ids)
+            due = [t for t in due if t['id'] in wanted]
+        navs = self.resolve_navs([t for t in due if t['id'] not in overrides and "场内" not in str(t.get('channel'))], day, force)
+        ready, skipped = [], []
+        for t in due:
+            nav = overrides.get(t['id']) or navs.get((t['code'], t['trade_date']))
+            if nav and nav > 0: ready.append((t, float(nav)))
+            elif "场内" in str(t.get('channel')): skipped.append((t, "场内成交价需手动确认"))
+            elif (self.store.earliest(t['code']) or "") > t['trade_date']: skipped.append((t, "本地净值未覆盖成交日，请补全历史净值"))
+            else: skipped.append((t, "成交日净值未公布"))
+        return ready, skipped
+
+    # ---------- 结算 ----------
+    def settle(self, day=None, tx_ids=None, overrides=None, mode="manual"):
+        """结算所有到期 (或指定) 交易，返回 {"batch", "settled": [...], "skipped": [...]}"""
+        with self._lock, metrics.timer("settlement_seconds", mode=mode):
+            ready, skipped = self.preview(day, tx_ids, overrides)
+            result = {"batch": None, "settled": [], "skipped": [{"id": t['id'], "code": t['code'], "reason": r} for t, r in skipped]}
+            if not ready: return result
+            batch = uuid.uuid4().hex
+            new_df, changes = apply_trades(self.portfolio.load(), ready)
+            items = [dict({k: c['tx'].get(k, "") for k in ("id", "code", "name", "type", "trade_date")}, channel=c['key'][1],
+                          **{k: c[k] for k in ("nav", "shares", "amount", "before", "after")}) for c in changes]
+            after = list({(it['code'], it['channel']): [it['code'], it['channel'], *it['after']] for it in items}.values())
+            self._audit({"op": "prepare", "batch": batch, "ts": time.time(), "mode": mode, "day": str(day or datetime.now().date()),
+                         "items": items, "skipped": result['skipped'], "after": after})
+            self.portfolio.save(new_df)
+            self.journal.apply_status([(it['id'], "settled", {"settle_nav": it['nav'], "batch": batch}) for it in items])
+            self._audit({"op": "commit", "batch": batch, "ts": time.time()})
+            metrics.inc("settled_total", len(items), mode=mode)
+            result.update(batch=batch, settled=items)
+            return result
+
+    def maybe_auto(self, day=None):
+        """自动结算：有到期交易时最多每 AUTO_INTERVAL 秒尝试一次"""
+        if time.time() - self._last_auto < AUTO_INTERVAL: return None
+        self._last_auto = time.time()
+        if not self.journal.due(str(day or datetime.now().date())): return None
+        return self.settle(day, mode="auto")
+
+    # ---------- 审计日志 ----------
+    def _audit(self, record):
+        with open(self.audit_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush(); os.fsync(f.fileno())
+
+    def _read_audit(self):
+        if not os.path.exists(self.audit_path): return []
+        out = []
+        with open(self.audit_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try: out.append(json.loads(line))
+                except ValueError: pass
+        return out
+
+    def history(self, limit=20):
+        """最近已提交的结算批次 (新的在前)"""
+        records = self._read_audit()
+        done = {r['batch'] for r in records if r.get('op') == "commit"}
+        return [r for r in records if r.get('op') == "prepare" and r['batch'] in done][::-1][:limit]
+
+    def _recover(self):
+        """补完上次中断的批次：持仓已按批次写入则补写交易状态并提交，否则作废"""
+        records = self._read_audit()
+        closed = {r['batch'] for r in records if r.get('op') in ("commit", "abort")}
+        for r in records:
+            if r.get('op') != "prepare" or r['batch'] in closed: continue
+            df = self.portfolio.load()
+            current = {(c, str(ch)): (float(s), float(k)) for c, ch, s, k in zip(df['code'], df['channel'], df['shares'], df['cost'])}
+            after = r['after']
+            if isinstance(after, dict):  # 旧格式只按代码记录：取该代码的第一行
+                after = [[c, next((k[1] for k in current if k[0] == c), ""), *a] for c, a in after.items()]
+            written = all((c, ch) in current and abs(current[(c, ch)][0] - s) < 1e-6 and abs(current[(c, ch)][1] - k) < 1e-6 for c, ch, s, k in after)
+            if written:
+                pending = {t['id'] for t in self.journal.pending()}
+                self.journal.apply_status([(it['id'], "settled", {"settle_nav": it['nav'], "batch": r['batch']}) for it in r['items'] if it['id'] in pending])
+                self._audit({"op": "commit", "batch": r['batch'], "ts": time.time(), "recovered": True})
+            else:
+                self._audit({"op": "abort", "batch": r['batch'], "ts": time.time()})
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None: _engine = SettlementEngine()
+        return _engine
@@ -0,0 +1,165 @@
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+
+# ==========================================
+# 追加式交易日志 (JSONL)
+# ==========================================
+# 每行一个事件：{"op": "add", "id", "tx", "ts"} 或 {"op": "status", "id", "status", "ts", ...}
+# 状态变更(结算/撤销)只追加新事件，不改写历史；日志过长时折叠为每笔一行的快照。
+JOURNAL_FILE = "transactions.jsonl"
+LEGACY_FILE = "transactions.json"
+COMPACT_MIN_EVENTS = 200  # 事件数超过 max(此值, 2×交易数) 时压缩
+
+class TransactionJournal:
+    """内存中维护 id / 状态 / 代码 / 确认日 索引；文件只追加，读取时增量跟进文件尾部。"""
+
+    def __init__(self, path=JOURNAL_FILE, legacy_path=LEGACY_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self._reset()
+        if not os.path.exists(path) and legacy_path and os.path.exists(legacy_path):
+            self._migrate(legacy_path)
+        self._sync()
+        if self._events > max(COMPACT_MIN_EVENTS, 2 * len(self._txs)): self.compact()
+
+    def _reset(self):
+        self._txs = {}          # id -> 交易记录 (含 id / status)
+        self._by_status = {}    # status -> {id: None} (保持提交顺序)
+        self._by_code = {}      # code -> {id: None}
+        self._by_date = {}      # confirm_date -> {id: None}
+        self._dates = []        # 已排序的 confirm_date
+        self._offset, self._events, self._inode = 0, 0, None
+
+    # ---------- 读取 ----------
+    def _sync(self):
+        """只解析上次读取位置之后新追加的行；文件被压缩替换时整体重放"""
+        with self._lock:
+            if not os.path.exists(self.path): return
+            st = os.stat(self.path)
+            if st.st_ino != self._inode or st.st_size < self._offset:
+                self._reset()
+                self._inode = st.st_ino
+            if st.st_size == self._offset: return
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                chunk = f.read()
+            end = chunk.rfind(b"\n") + 1  # 只消费完整的行
+            for line in chunk[:end].splitlines():
+                if not line.strip(): continue
+                try: self._apply(json.loads(line))
+                except (ValueError, KeyError) as e: print(f"Journal skip bad line: {e}")
+            self._offset += end
+
+    def _apply(self, ev):
+        self._events += 1
+        if ev['op'] == "add":
+            tx = dict(ev['tx'], id=ev['id'])
+            tx.setdefault('status', "pending")
+            self._txs[tx['id']] = tx
+            self._by_status.setdefault(tx['status'], {})[tx['id']] = None
+            self._by_code.setdefault(tx.get('code'), {})[tx['id']] = None
+            d = tx.get('confirm_date', "")
+            if d not in self._by_date:
+                self._by_date[d] = {}
+                bisect.insort(self._dates, d)
+            self._by_date[d][tx['id']] = None
+        elif ev['op'] == "status":
+            tx = self._txs.get(ev['id'])
+            if tx is None: return
+            self._by_status.get(tx['status'], {}).pop(tx['id'], None)
+            tx.update({k: v for k, v in ev.items() if k not in ("op", "id", "ts")})
+            tx['updated_at'] = ev.get('ts')
+            self._by_status.setdefault(tx['status'], {})[tx['id']] = None
+
+    def get(self, tx_id):
+        self._sync()
+        with self._lock: return dict(self._txs[tx_id]) if tx_id in self._txs else None
+
+    def all(self):
+        self._sync()
+        with self._lock: return [dict(t) for t in self._txs.values()]
+
+    def by_status(self, status):
+        self._sync()
+        with self._lock: return [dict(self._txs[i]) for i in self._by_status.get(status, {})]
+
+    def pending(self): return self.by_status("pending")
+
+    def by_code(self, code):
+        self._sync()
+        with self._lock: return [dict(self._txs[i]) for i in self._by_code.get(code, {})]
+
+    def due(self, day):
+        """确认日 <= day 的待处理交易"""
+        self._sync()
+        with self._lock:
+            pend = self._by_status.get("pending", {})
+            hi = bisect.bisect_right(self._dates, str(day))
+            return [dict(self._txs[i]) for d in self._dates[:hi] for i in self._by_date[d] if i in pend]
+
+    # ---------- 写入 ----------
+    def _append(self, events):
+        with self._lock:
+            self._sync()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(ev, ensure_ascii=False) + "\n" for ev in events))
+            self._sync()
+
+    def add(self, tx):
+        tx_id = uuid.uuid4().hex
+        self._append([{"op": "add", "id": tx_id, "tx": dict(tx), "ts": time.time()}])
+        return tx_id
+
+    def add_many(self, txs):
+        """批量新增 (如导入历史交易)，一次追加写入，返回各笔 id"""
+        now = time.time()
+        events = [{"op": "add", "id": uuid.uuid4().hex, "tx": dict(t), "ts": now} for t in txs]
+        if events: self._append(events)
+        return [ev['id'] for ev in events]
+
+    def set_status(self, tx_id, status, **extra):
+        """结算/撤销：追加一条状态事件，extra 一并记录 (如成交净值)"""
+        self.set_status_many([tx_id], status, **extra)
+
+    def set_status_many(self, tx_ids, status, **extra):
+        self.apply_status([(i, status, extra) for i in tx_ids])
+
+    def apply_status(self, updates):
+        """批量状态变更，每笔可带各自的附加字段：[(tx_id, status, extra)]，一次追加写入"""
+        now = time.time()
+        self._append([dict(extra or {}, op="status", id=i, status=status, ts=now) for i, status, extra in updates])
+
+    def compact(self):
+        """把事件折叠为每笔一条 add 记录，原子替换文件"""
+        with self._lock:
+            self._sync()
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for tx in self._txs.values():
+                    body = {k: v for k, v in tx.items() if k != "id"}
+                    f.write(json.dumps({"op": "add", "id": tx['id'], "tx": body, "ts": tx.get('updated_at')}, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+            self._reset()
+            self._sync()
+
+    def _migrate(self, legacy_path):
+        """首次启动时导入旧版 transactions.json，并改名保留原文件"""
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f: legacy = json.load(f)
+        except (OSError, ValueError): return
+        now = time.time()
+        self._append([{"op": "add", "id": uuid.uuid4().hex, "tx": t, "ts": now} for t in legacy])
+        os.replace(legacy_path, legacy_path + ".migrated")
+
+_journal = None
+_journal_lock = threading.Lock()
+
+def get_journal():
+    global _journal
+    with _journal_lock:
+        if _journal is None: _journal = TransactionJournal()
+        return _journal
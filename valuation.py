@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+import metrics
+
+# ==========================================
+# 列式估值引擎
+# ==========================================
+RESULT_COLUMNS = ["基金代码", "基金名称", "渠道", "持仓成本", "持有份额", "持仓金额", "最新净值", "今日盈亏", "总盈亏", "est_rate", "已更新", "数据源"]
+
+def calculate_dashboard_data(current_df, quotes):
+    """持仓与共享快照 {(code, channel): 数据} 对齐成 NumPy 数组，一次向量化算出市值/今日盈亏/总盈亏及合计。
+    返回 (按持仓金额降序的数值 DataFrame, 今日盈亏, 总盈亏, 总资产)；快照中尚无数据的行暂不展示，格式化留到渲染时。"""
+    with metrics.timer("calculate_dashboard_seconds"):
+        return _calculate(current_df, quotes)
+
+def _calculate(current_df, quotes):
+    today_str = str(datetime.now().date())
+    codes = current_df['code'].to_numpy(dtype=object)
+    channels = current_df['channel'].astype(str).to_numpy(dtype=object)
+    hit = np.fromiter(((c, ch) in quotes for c, ch in zip(codes, channels)), dtype=bool, count=len(codes))
+    qs = [quotes[(c, ch)] for c, ch, h in zip(codes, channels, hit) if h]
+    n = len(qs)
+
+    live = np.fromiter((d['live_price'] for d in qs), dtype=float, count=n)
+    base = np.fromiter((d['base_nav'] for d in qs), dtype=float, count=n)
+    rate = np.fromiter((d['est_rate'] for d in qs), dtype=float, count=n)
+    nav_today = np.fromiter((d.get('nav_date') == today_str for d in qs), dtype=bool, count=n)
+    shares = current_df['shares'].to_numpy(dtype=float)[hit]
+    cost = current_df['cost'].to_numpy(dtype=float)[hit]
+    channels = channels[hit]
+
+    val = live * shares
+    day_gain = (live - base) * shares
+    acc_gain = (live - cost) * shares
+    out = pd.DataFrame({
+        "基金代码": codes[hit], "基金名称": current_df['name'].to_numpy(dtype=object)[hit], "渠道": channels,
+        "持仓成本": cost, "持有份额": shares, "持仓金额": val, "最新净值": live, "今日盈亏": day_gain, "总盈亏": acc_gain,
+        "est_rate": rate, "已更新": nav_today & pd.Series(channels, dtype=str).str.contains("场外", regex=False).to_numpy(dtype=bool),
+        "数据源": [d['source'] for d in qs],
+    }, columns=RESULT_COLUMNS)
+    out = out.iloc[np.argsort(-val, kind='stable')].reset_index(drop=True)
+    return out, float(day_gain.sum()), float(acc_gain.sum()), float(val.sum())
+
+def format_rate_column(df):
+    """渲染时才生成 涨跌幅 文本列 (如 +1.23% (已更新))"""
+    return (df['est_rate'] * 100).map("{:+.2f}%".format) + np.where(df['已更新'], " (已更新)", "")